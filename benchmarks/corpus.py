@@ -0,0 +1,223 @@
+"""
+A deterministic corpus of synthetic Python files for the benchmarks, so that the results are
+comparable across commits and machines.
+"""
+import random
+from typing import Dict, List, Tuple
+
+_TYPES = [
+    "int",
+    "str",
+    "float",
+    "bool",
+    "bytes",
+    "List[int]",
+    "Dict[str, Any]",
+    "Optional[str]",
+    "Tuple[int, str]",
+    "Set[FrozenSet[int]]",
+    "Callable[[int, str], bool]",
+    "Iterator[Tuple[str, List[float]]]",
+    "Dict[str, List[Tuple[int, Optional[Node]]]]",
+    "Union[int, str, None]",
+    "Mapping[str, Sequence[Node]]",
+    "typing.Deque[int]",
+    "Node",
+    "Leaf",
+    "NodeId",
+]
+
+
+def _indent(lines: List[str], depth: int) -> List[str]:
+    return ["    " * depth + line for line in lines]
+
+
+def _function(rng: random.Random, name: str, annotated: bool, body_statements: int) -> List[str]:
+    params = [f"p{i}" for i in range(rng.randint(1, 5))]
+    if annotated:
+        signature = ", ".join(f"{p}: {rng.choice(_TYPES)}" for p in params)
+        lines = [f"def {name}({signature}) -> {rng.choice(_TYPES)}:"]
+    else:
+        lines = [f"def {name}({', '.join(params)}):"]
+    lines.append('    """A docstring."""')
+    for i in range(body_statements):
+        target, source = f"v{i}", rng.choice(params + [f"v{j}" for j in range(i)])
+        kind = rng.randrange(6)
+        if kind == 0:
+            lines.append(f"    {target} = {source} + {rng.randint(0, 100)}")
+        elif kind == 1:
+            lines.append(f"    {target} = [x * 2 for x in range({source}) if x % 3]")
+        elif kind == 2:
+            lines.append(f"    {target} = {{k: str(k) for k in {source}}}")
+        elif kind == 3:
+            lines.append(f"    {target} = {source}.attr.method(1, key={source!r})")
+        elif kind == 4 and annotated:
+            lines.append(f"    {target}: {rng.choice(_TYPES)} = {source}")
+        else:
+            lines.append(f"    {target} = {source} if {source} else None")
+        params.append(target)
+    lines.append(f"    return {params[-1]}")
+    return lines
+
+
+def _nested_block(rng: random.Random, depth: int, max_depth: int) -> List[str]:
+    variable = f"x{depth}"
+    if depth == max_depth:
+        return [f"total += {variable}", "yield total"]
+    body = _nested_block(rng, depth + 1, max_depth)
+    kind = rng.randrange(5)
+    if kind == 0:
+        lines = [f"if {variable} > {depth}:"] + _indent(body, 1)
+        lines += ["else:"] + _indent([f"{variable} = -{variable}"], 1)
+    elif kind == 1:
+        lines = [f"for x{depth + 1} in range({variable}):"] + _indent(body, 1)
+        lines += ["else:"] + _indent([f"total -= {variable}"], 1)
+    elif kind == 2:
+        lines = [f"while {variable} < 10:", f"    {variable} += 1"] + _indent(body, 1)
+        lines += _indent([f"if {variable} == 5:", "    break"], 1)
+    elif kind == 3:
+        lines = ["try:"] + _indent(body, 1)
+        lines += ["except (ValueError, KeyError) as e:"] + _indent([f"total -= {variable}"], 1)
+        lines += ["finally:"] + _indent([f"{variable} = 0"], 1)
+    else:
+        lines = [f"with open({variable}) as x{depth + 1}:"] + _indent(body, 1)
+    return [f"x{depth + 1} = {variable} * 2"] + lines
+
+
+def large_file(seed: int = 0, num_functions: int = 120) -> str:
+    """A large module with many classes and functions and few annotations."""
+    rng = random.Random(seed)
+    lines = ["import os", "import sys", "from collections import defaultdict", ""]
+    for i in range(num_functions):
+        if i % 10 == 0:
+            lines += ["", f"class Class{i}(object):", f"    counter = {i}", ""]
+        function = _function(rng, f"function{i}", rng.random() < 0.2, rng.randint(3, 15))
+        lines += _indent(function, 1) if i % 10 < 5 else [""] + function
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def annotated_file(seed: int = 0, num_functions: int = 150) -> str:
+    """A heavily annotated module, with a class hierarchy and NewType aliases."""
+    rng = random.Random(seed)
+    lines = [
+        "import typing",
+        "from typing import *",
+        "",
+        "NodeId = NewType('NodeId', int)",
+        "",
+        "class Node(Generic[T]):",
+        "    children: List['Node']",
+        "",
+        "class Leaf(Node[int], Mapping[str, int]):",
+        "    pass",
+        "",
+    ]
+    for i in range(num_functions):
+        lines += _function(rng, f"function{i}", True, rng.randint(2, 10))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def nested_control_flow_file(seed: int = 0, num_functions: int = 40, max_depth: int = 12) -> str:
+    """Functions with deeply nested branches and loops, which stress the dataflow analysis."""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(num_functions):
+        lines += [f"def function{i}(x0, total):"]
+        lines += _indent(_nested_block(rng, 0, max_depth), 1)
+        lines += ["    return total", ""]
+    return "\n".join(lines) + "\n"
+
+
+def branching_file(seed: int = 0, num_functions: int = 5, num_branches: int = 150) -> str:
+    """
+    Long functions with many sequential and nested branches over many live variables, which
+    stress the forking and merging of the last uses in the dataflow analysis.
+    """
+    rng = random.Random(seed)
+    module_variables = [f"g{i}" for i in range(300)]
+    lines = [f"{v} = {i}" for i, v in enumerate(module_variables)] + [""]
+    for i in range(num_functions):
+        variables = [f"v{j}" for j in range(100)]
+        lines.append(f"def function{i}({', '.join(variables[:5])}):")
+        lines += [f"    {v} = {rng.choice(module_variables)}" for v in variables[5:]]
+        for j in range(num_branches):
+            depth = 1 + j % 4
+            for k in range(depth):
+                used, assigned = rng.sample(variables, 2)
+                indent = "    " * (k + 1)
+                if rng.random() < 0.5:
+                    lines.append(f"{indent}if {used} > {k}:")
+                    lines.append(f"{indent}    {assigned} = {used}")
+                    lines.append(f"{indent}elif {assigned} < {k}:")
+                else:
+                    lines.append(f"{indent}try:")
+                    lines.append(f"{indent}    {assigned} = {used} // {assigned}")
+                    lines.append(f"{indent}except ZeroDivisionError:")
+            used, assigned = rng.sample(variables, 2)
+            lines.append(f"{'    ' * (depth + 1)}{assigned} = {used} + {rng.choice(variables)}")
+        lines += [f"    return {' + '.join(variables[:10])}", ""]
+    return "\n".join(lines) + "\n"
+
+
+def benchmark_corpus() -> Dict[str, str]:
+    """The corpus of the benchmarks, as a dict from a file name to its content."""
+    return {
+        "large.py": large_file(),
+        "annotated.py": annotated_file(),
+        "nested.py": nested_control_flow_file(),
+    }
+
+
+_GENERIC_TYPES = [
+    ("typing.List", 1),
+    ("typing.Set", 1),
+    ("typing.Optional", 1),
+    ("typing.Iterator", 1),
+    ("typing.Dict", 2),
+    ("typing.Mapping", 2),
+    ("typing.Tuple", 2),
+    ("typing.Union", 3),
+    ("typing.DefaultDict", 2),
+]
+_SIMPLE_TYPES = ["int", "str", "float", "bool", "bytes", "typing.Any", "None", "os.PathLike"]
+
+
+def _random_annotation(rng: random.Random, project_classes: List[str], depth: int) -> str:
+    if depth == 0 or rng.random() < 0.3:
+        return rng.choice(_SIMPLE_TYPES + project_classes)
+    name, arity = rng.choice(_GENERIC_TYPES)
+    args = [_random_annotation(rng, project_classes, depth - 1) for _ in range(arity)]
+    return f"{name}[{', '.join(args)}]"
+
+
+def lattice_inputs(
+    seed: int = 0, num_annotations: int = 2000, num_classes: int = 200
+) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """
+    Random nested annotations over a project class hierarchy, for the type lattice.
+    Returns the (class, parent) pairs and the annotations.
+    """
+    rng = random.Random(seed)
+    classes = []
+    for i in range(num_classes):
+        parent = rng.choice(classes + ["object", "Exception", "dict", "typing.Mapping[str, int]"])
+        classes.append((f"Class{i}", parent))
+    class_names = [name for name, _ in classes]
+    annotations = [_random_annotation(rng, class_names, 3) for _ in range(num_annotations)]
+    return classes, annotations
+
+
+def class_hierarchy(seed: int = 0, num_classes: int = 1000) -> List[Tuple[str, List[str]]]:
+    """
+    A deep hierarchy of project classes, each with one or two parents among the last classes,
+    as (class, parents) pairs. The number of ancestors of a class grows with the hierarchy.
+    """
+    rng = random.Random(seed)
+    classes = [("Class0", ["object"])]
+    for i in range(1, num_classes):
+        recent_classes = [name for name, _ in classes[-20:]]
+        parents = rng.sample(recent_classes, min(2, len(recent_classes)))
+        classes.append((f"Class{i}", parents))
+    return classes
@@ -0,0 +1,125 @@
+"""
+Fuzz the parser of the annotation strings against typed_ast: random annotations, valid or not,
+are parsed with and without the recursive-descent parser, which must return the same node.
+
+Usage:
+    fuzz_annotation_parser.py [options]
+
+Options:
+    --iterations=N             The number of random annotations. [default: 100000]
+    --seed=S                   The seed of the random annotations. [default: 0]
+    -h --help                  Show this screen.
+
+Run from the root of the repository with
+`PYTHONPATH=src python benchmarks/fuzz_annotation_parser.py`.
+"""
+import contextlib
+import random
+import sys
+
+from docopt import docopt
+
+from graph_generator.typeparsing import nodes
+
+_NAMES = [
+    "int",
+    "str",
+    "List",
+    "Dict",
+    "typing",
+    "Optional",
+    "None",
+    "True",
+    "x",
+    "async",
+    "lambda",
+]
+_TOKENS = ["[", "]", "(", ")", ",", ".", "...", " ", "'", '"', "1", ":", "|", "-", "\t", "\n"]
+
+
+def _random_annotation(rng: random.Random, depth: int) -> str:
+    kind = rng.randrange(10) if depth > 0 else 0
+    if kind <= 2:
+        return rng.choice(_NAMES)
+    elif kind == 3:
+        return _random_annotation(rng, depth - 1) + "." + rng.choice(_NAMES)
+    elif kind <= 5:
+        elements = [_random_annotation(rng, depth - 1) for _ in range(rng.randint(0, 3))]
+        separator = rng.choice([", ", ",", " , "])
+        trailing_comma = "," if rng.random() < 0.2 else ""
+        return (
+            _random_annotation(rng, depth - 1)
+            + "["
+            + separator.join(elements)
+            + trailing_comma
+            + "]"
+        )
+    elif kind == 6:
+        elements = [_random_annotation(rng, depth - 1) for _ in range(rng.randint(0, 3))]
+        return rng.choice(["[%s]", "(%s)", "%s"]) % ", ".join(elements)
+    elif kind == 7:
+        quote = rng.choice(["'", '"'])
+        return quote + _random_annotation(rng, depth - 1) + quote
+    elif kind == 8:
+        return "..."
+    else:
+        return rng.choice(["(", "["]) + _random_annotation(rng, depth - 1) + rng.choice([")", "]"])
+
+
+def _mutate(rng: random.Random, annotation: str) -> str:
+    for _ in range(rng.randint(1, 3)):
+        position = rng.randint(0, len(annotation))
+        kind = rng.randrange(3)
+        if kind == 0:
+            annotation = annotation[:position] + rng.choice(_TOKENS) + annotation[position:]
+        elif kind == 1:
+            annotation = annotation[:position] + annotation[position + 1 :]
+        else:
+            annotation = annotation[:position] + rng.choice(_TOKENS) + annotation[position + 1 :]
+    return annotation
+
+
+def _unsupported(annotation: str):
+    raise nodes._UnsupportedAnnotation()
+
+
+@contextlib.contextmanager
+def _typed_ast_only():
+    parse_annotation_string = nodes._parse_annotation_string
+    nodes._parse_annotation_string = _unsupported
+    try:
+        yield
+    finally:
+        nodes._parse_annotation_string = parse_annotation_string
+
+
+def run(arguments) -> int:
+    rng = random.Random(int(arguments["--seed"]))
+    parse = nodes.parse_type_comment.__wrapped__  # Without the cache.
+    num_parsed, num_mismatches = 0, 0
+    for _ in range(int(arguments["--iterations"])):
+        annotation = _random_annotation(rng, 3)
+        if rng.random() < 0.5:
+            annotation = _mutate(rng, annotation)
+
+        with _typed_ast_only():
+            expected = parse(annotation)
+        try:
+            nodes._parse_annotation_string(annotation)
+            num_parsed += 1
+        except nodes._UnsupportedAnnotation:
+            pass
+        actual = parse(annotation)
+        if actual is not expected:
+            num_mismatches += 1
+            print(f"Mismatch for {annotation!r}: {actual!r} instead of {expected!r}")
+
+    print(
+        f"{num_mismatches} mismatches. {num_parsed} annotations were parsed without typed_ast, "
+        f"out of {arguments['--iterations']}."
+    )
+    return 1 if num_mismatches > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(docopt(__doc__)))
@@ -0,0 +1,295 @@
+"""
+Micro-benchmarks of the graph generation, the dataflow analyses, the type lattice and the type
+annotation visitors over a fixed synthetic corpus (see corpus.py).
+
+All the metrics are throughputs (higher is better). Each benchmark is run --repeats times and
+the fastest run is reported.
+
+Usage:
+    run_benchmarks.py [options] [BENCHMARK ...]
+
+Options:
+    --repeats=N                Run each benchmark N times. [default: 3]
+    --output=PATH              Save the results as JSON, e.g. to use as a baseline.
+    --baseline=PATH            Compare the results to a baseline saved with --output.
+    --threshold=T              Fail if a metric is more than T slower than the baseline. [default: 0.1]
+    --typing-rules=PATH        The path to the typing rules. Defaults to src/metadata/typingRules.json
+    -h --help                  Show this screen.
+
+Run from the root of the repository with `PYTHONPATH=src python benchmarks/run_benchmarks.py`.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+from docopt import docopt
+
+from corpus import (
+    benchmark_corpus,
+    branching_file,
+    class_hierarchy,
+    lattice_inputs,
+    nested_control_flow_file,
+)
+from graph_generator.extract_graphs import RecordingTypeLattice
+from graph_generator.graphgenerator import AstGraphGenerator
+from graph_generator.phasetimings import timings
+from graph_generator.type_lattice_generator import TypeLatticeGenerator
+from graph_generator.typeparsing import (
+    EraseOnceTypeRemoval,
+    PruneAnnotationVisitor,
+    RewriteRuleVisitor,
+    parse_type_annotation_node,
+    parse_type_comment,
+)
+from graph_generator.typeparsing.rewriterules import (
+    RemoveGenericWithAnys,
+    RemoveRecursiveGenerics,
+    RemoveStandAlones,
+    RemoveUnionWithAnys,
+)
+
+DEFAULT_TYPING_RULES_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "src", "metadata", "typingRules.json"
+)
+
+Metrics = Dict[str, float]
+
+
+def bench_graph_generation(typing_rules_path: str) -> Metrics:
+    """AstGraphGenerator.build, including the dataflow pass."""
+    corpus = benchmark_corpus()
+    type_lattice = TypeLatticeGenerator(typing_rules_path)
+    num_nodes, num_edges, num_dataflow_edges = 0, 0, 0
+    timings.phases = {}
+    start_time = time.perf_counter()
+    for source in corpus.values():
+        graph = AstGraphGenerator(source, type_lattice).build()
+        num_nodes += len(graph["nodes"])
+        num_edges += sum(len(t) for e in graph["edges"].values() for t in e.values())
+        num_dataflow_edges += sum(len(t) for t in graph["edges"].get("NEXT_USE", {}).values())
+    elapsed = time.perf_counter() - start_time
+    dataflow_time = timings.phases["DataflowPass"].wall_time
+    return {
+        "files_per_second": len(corpus) / elapsed,
+        "nodes_per_second": num_nodes / elapsed,
+        "edges_per_second": num_edges / elapsed,
+        "dataflow_files_per_second": len(corpus) / dataflow_time,
+        "dataflow_edges_per_second": num_dataflow_edges / dataflow_time,
+    }
+
+
+def bench_dataflow_branching(typing_rules_path: str) -> Metrics:
+    """The dataflow pass over long functions with many branches and live variables."""
+    source = branching_file()
+    type_lattice = TypeLatticeGenerator(typing_rules_path)
+    timings.phases = {}
+    graph = AstGraphGenerator(source, type_lattice).build()
+    dataflow_time = timings.phases["DataflowPass"].wall_time
+    num_dataflow_edges = sum(len(t) for t in graph["edges"].get("NEXT_USE", {}).values())
+    return {
+        "dataflow_lines_per_second": source.count("\n") / dataflow_time,
+        "dataflow_edges_per_second": num_dataflow_edges / dataflow_time,
+    }
+
+
+def bench_dataflow_cfg(typing_rules_path: str) -> Metrics:
+    """The reaching-uses analysis over the control-flow graph, on loop-heavy and branched files."""
+    sources = [nested_control_flow_file(), branching_file()]
+    type_lattice = TypeLatticeGenerator(typing_rules_path)
+    num_lines, num_dataflow_edges, dataflow_time = 0, 0, 0.0
+    for source in sources:
+        timings.phases = {}
+        graph = AstGraphGenerator(source, type_lattice, cfg_dataflow=True).build()
+        dataflow_time += timings.phases["DataflowPass"].wall_time
+        num_lines += source.count("\n")
+        num_dataflow_edges += sum(len(t) for t in graph["edges"].get("NEXT_USE", {}).values())
+    return {
+        "dataflow_lines_per_second": num_lines / dataflow_time,
+        "dataflow_edges_per_second": num_dataflow_edges / dataflow_time,
+    }
+
+
+def bench_type_lattice(typing_rules_path: str) -> Metrics:
+    """TypeLatticeGenerator.add_class/add_type and build_graph."""
+    classes, annotations = lattice_inputs()
+    class_parents = [(name, parse_type_annotation_node(parent)) for name, parent in classes]
+    annotations = [parse_type_annotation_node(a) for a in annotations]
+
+    type_lattice = TypeLatticeGenerator(typing_rules_path)
+    num_initial_types = len(type_lattice.return_json()["nodes"])
+    start_time = time.perf_counter()
+    for name, parent in class_parents:
+        type_lattice.add_class(name, [parent])
+    for annotation in annotations:
+        type_lattice.add_type(annotation, {})
+    type_lattice.build_graph()
+    elapsed = time.perf_counter() - start_time
+    num_types = len(type_lattice.return_json()["nodes"]) - num_initial_types
+    return {
+        "lattice_types_per_second": num_types / elapsed,
+        "added_annotations_per_second": len(annotations) / elapsed,
+    }
+
+
+def bench_project_lattice(typing_rules_path: str) -> Metrics:
+    """The type lattice, as built from the annotations found in the corpus."""
+    corpus = benchmark_corpus()
+    recording_lattice = RecordingTypeLattice(TypeLatticeGenerator(typing_rules_path))
+    for source in corpus.values():
+        AstGraphGenerator(source, recording_lattice).build()
+
+    type_lattice = TypeLatticeGenerator(typing_rules_path)
+    num_initial_types = len(type_lattice.return_json()["nodes"])
+    start_time = time.perf_counter()
+    RecordingTypeLattice.replay(recording_lattice.operations, type_lattice)
+    type_lattice.build_graph()
+    elapsed = time.perf_counter() - start_time
+    num_types = len(type_lattice.return_json()["nodes"]) - num_initial_types
+    return {"lattice_types_per_second": num_types / elapsed}
+
+
+def bench_lattice_scaling(typing_rules_path: str) -> Metrics:
+    """
+    The type lattice of deep class hierarchies of increasing sizes. The throughput stays flat
+    when the build time is linear in the number of project types.
+    """
+    metrics = {}
+    for num_classes in (500, 1000, 2000, 4000):
+        classes = [
+            (name, [parse_type_annotation_node(p) for p in parents])
+            for name, parents in class_hierarchy(num_classes=num_classes)
+        ]
+        annotations = [parse_type_annotation_node(f"typing.List[{name}]") for name, _ in classes]
+
+        type_lattice = TypeLatticeGenerator(typing_rules_path)
+        num_initial_types = len(type_lattice.return_json()["nodes"])
+        start_time = time.perf_counter()
+        for name, parents in classes:
+            type_lattice.add_class(name, parents)
+        for annotation in annotations:
+            type_lattice.add_type(annotation, {})
+        type_lattice.build_graph()
+        elapsed = time.perf_counter() - start_time
+        num_types = len(type_lattice.return_json()["nodes"]) - num_initial_types
+        metrics[f"types_per_second_{num_classes}_classes"] = num_types / elapsed
+    return metrics
+
+
+def bench_typeparsing(typing_rules_path: str) -> Metrics:
+    """
+    Parsing annotations, first with a cold and then with a warm parse cache, and running the
+    erasure, pruning and rewrite rule visitors on them.
+    """
+    _, annotations = lattice_inputs()
+    erasure = EraseOnceTypeRemoval()
+    pruning = PruneAnnotationVisitor(TypeLatticeGenerator.ANY_TYPE, 2)
+    rewriting = RewriteRuleVisitor(
+        [
+            RemoveUnionWithAnys(),
+            RemoveStandAlones(),
+            RemoveRecursiveGenerics(),
+            RemoveGenericWithAnys(),
+        ]
+    )
+
+    parse_type_comment.cache_clear()
+    start_time = time.perf_counter()
+    parsed = [parse_type_annotation_node(a) for a in annotations]
+    parse_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for a in annotations:
+        parse_type_annotation_node(a)
+    cached_parse_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for annotation in parsed:
+        annotation.accept_visitor(erasure)
+        annotation.accept_visitor(pruning, 2)
+    visit_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for annotation in parsed:
+        annotation.accept_visitor(rewriting, None)
+    rewrite_time = time.perf_counter() - start_time
+    return {
+        "parsed_annotations_per_second": len(annotations) / parse_time,
+        "cached_parses_per_second": len(annotations) / cached_parse_time,
+        "visited_annotations_per_second": len(annotations) / visit_time,
+        "rewritten_annotations_per_second": len(annotations) / rewrite_time,
+    }
+
+
+BENCHMARKS = {
+    "graph_generation": bench_graph_generation,
+    "dataflow_branching": bench_dataflow_branching,
+    "dataflow_cfg": bench_dataflow_cfg,
+    "type_lattice": bench_type_lattice,
+    "project_lattice": bench_project_lattice,
+    "lattice_scaling": bench_lattice_scaling,
+    "typeparsing": bench_typeparsing,
+}  # type: Dict[str, Callable[[str], Metrics]]
+
+
+def run_benchmarks(names: List[str], typing_rules_path: str, repeats: int) -> Dict[str, Metrics]:
+    results = {}
+    for name in names:
+        runs = []
+        for _ in range(repeats):
+            with contextlib.redirect_stdout(io.StringIO()):  # Silence the progress prints.
+                runs.append(BENCHMARKS[name](typing_rules_path))
+        results[name] = {metric: max(run[metric] for run in runs) for metric in runs[0]}
+        for metric, value in results[name].items():
+            print(f"{name:20} {metric:35} {value:14.1f}")
+    return results
+
+
+def compare_to_baseline(
+    results: Dict[str, Metrics], baseline: Dict[str, Metrics], threshold: float
+) -> List[str]:
+    """Return a description of each metric that is more than threshold slower than the baseline."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline_value = baseline.get(name, {}).get(metric)
+            if baseline_value is None:
+                continue
+            change = value / baseline_value - 1
+            print(f"{name:20} {metric:35} {change:+8.1%} vs baseline")
+            if change < -threshold:
+                regressions.append(f"{name}/{metric}: {value:.1f} vs {baseline_value:.1f}")
+    return regressions
+
+
+def main(args) -> int:
+    names = args["BENCHMARK"] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark {name}. Choose from {', '.join(BENCHMARKS)}.")
+
+    results = run_benchmarks(
+        names, args["--typing-rules"] or DEFAULT_TYPING_RULES_PATH, int(args["--repeats"])
+    )
+    if args["--output"] is not None:
+        with open(args["--output"], "w") as f:
+            json.dump({"benchmarks": results}, f, indent=2)
+
+    if args["--baseline"] is not None:
+        with open(args["--baseline"]) as f:
+            baseline = json.load(f)["benchmarks"]
+        regressions = compare_to_baseline(results, baseline, float(args["--threshold"]))
+        if len(regressions) > 0:
+            print("Performance regressions:")
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt(__doc__)))
@@ -5,25 +5,30 @@ from typing import Dict, Set, List, NamedTuple
 HUNK_MATCH = re.compile("^@@ -\d+,\d+ \+(\d+),\d+ @@")
 
 
-def get_line_ranges_of_interest(diff_lines: List[str]) -> Set[int]:
+def get_line_ranges_of_interest(diff_lines: List[str], include_context: bool = False) -> Set[int]:
+    """The added lines, and with include_context also the unchanged lines shown in the hunks."""
     lines_of_interest = set()
     current_line = 0
     for line in diff_lines:
         hunk_start_match = HUNK_MATCH.match(line)
         if hunk_start_match:
             current_line = int(hunk_start_match.group(1))
+        elif line.startswith("\\"):
+            continue  # "\ No newline at end of file", which is not a line of the file.
         elif line.startswith("+"):
             lines_of_interest.add(current_line)
             current_line += 1
         elif not line.startswith("-"):
+            if include_context:
+                lines_of_interest.add(current_line)
             current_line += 1
-        elif line.startswith("\\"):
-            assert False, "When does this happen?"
 
     return lines_of_interest
 
 
-def get_changed_files(diff: str, suffix=".py") -> Dict[str, Set[int]]:
+def get_changed_files(
+    diff: str, suffix=".py", include_context: bool = False
+) -> Dict[str, Set[int]]:
     per_file_diff = diff.split("diff --git ")
     changed_files: Dict[str, Set[int]] = {}
     for file_diff in per_file_diff:
@@ -57,6 +62,8 @@ def get_changed_files(diff: str, suffix=".py") -> Dict[str, Set[int]]:
 
         if target_filepath.endswith(suffix):
             assert target_filepath not in changed_files
-            changed_files[target_filepath] = get_line_ranges_of_interest(remaining_lines)
+            changed_files[target_filepath] = get_line_ranges_of_interest(
+                remaining_lines, include_context
+            )
 
     return changed_files
@@ -0,0 +1,127 @@
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+
+class GitHubClient:
+    """
+    A thin client over the GitHub REST API that reuses a single keep-alive session and backs
+    off when GitHub rate-limits the requests (403/429).
+    """
+
+    RETRY_STATUS_CODES = frozenset({403, 429})
+
+    def __init__(
+        self,
+        token: str,
+        max_retries: int = 5,
+        max_backoff_seconds: float = 120,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.__session = requests.Session()
+        self.__session.headers.update({"authorization": f"Bearer {token}"})
+        self.__max_retries = max_retries
+        self.__max_backoff_seconds = max_backoff_seconds
+        self.__sleep = sleep
+
+    def close(self) -> None:
+        self.__session.close()
+
+    def __enter__(self) -> "GitHubClient":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def get_pull_request_diff(self, pull_request_url: str) -> str:
+        r = self.__request(
+            "GET", pull_request_url, headers={"Accept": "application/vnd.github.v3.diff"}
+        )
+        print("Diff GET Status Code: ", r.status_code)
+        r.raise_for_status()
+        return r.text
+
+    def create_review(
+        self, pull_request_url: str, commit_id: str, comments: List[Dict[str, Any]], body: str = ""
+    ) -> int:
+        """
+        Submit all the comments as a single review and return the number of posted comments.
+        Each comment is a dict with the "path", "line", "side" and "body" keys.
+
+        GitHub rejects the whole review (422) if any of its comments is invalid, e.g. on a line
+        outside the diff. The comments are then posted one by one, skipping the rejected ones.
+        """
+        data = {"commit_id": commit_id, "event": "COMMENT", "comments": comments}
+        if len(body) > 0:
+            data["body"] = body
+        r = self.__request(
+            "POST",
+            pull_request_url + "/reviews",
+            json=data,
+            headers={"Accept": "application/vnd.github.v3+json"},
+        )
+        if r.status_code != 422:
+            r.raise_for_status()
+            return len(comments)
+
+        print(f"GitHub rejected the review: {r.text}. Posting the comments one by one.")
+        num_posted = 0
+        for comment in comments:
+            r = self.__request(
+                "POST",
+                pull_request_url + "/comments",
+                json=dict(comment, commit_id=commit_id),
+                headers={"Accept": "application/vnd.github.v3+json"},
+            )
+            if r.ok:
+                num_posted += 1
+            else:
+                print(
+                    f"Failed to post the comment on {comment['path']}:{comment['line']}. "
+                    f"Status Code: {r.status_code}. Text: {r.text}"
+                )
+        return num_posted
+
+    def __request(self, method: str, url: str, **kwargs) -> requests.Response:
+        attempt = 0
+        while True:
+            r = self.__session.request(method, url, **kwargs)
+            if r.status_code not in self.RETRY_STATUS_CODES or attempt >= self.__max_retries:
+                return r
+            backoff = self.__backoff_seconds(r, attempt)
+            if backoff is None:
+                return r  # A 403 that is not due to rate-limiting.
+            print(f"Rate-limited by GitHub ({r.status_code}). Retrying in {backoff:.0f} seconds.")
+            self.__sleep(backoff)
+            attempt += 1
+
+    def __backoff_seconds(self, response: requests.Response, attempt: int) -> Optional[float]:
+        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            backoff = retry_after
+        elif response.headers.get("X-RateLimit-Remaining") == "0":
+            reset_time = float(response.headers.get("X-RateLimit-Reset", time.time()))
+            backoff = max(reset_time - time.time(), 1)
+        elif response.status_code == 429 or "rate limit" in response.text.lower():
+            # Secondary rate limits may come without headers, use an exponential backoff.
+            backoff = 2 ** (attempt + 1)
+        else:
+            return None
+        return min(backoff, self.__max_backoff_seconds)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """The seconds to wait from a Retry-After header, either seconds or an HTTP-date, if valid."""
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+        return seconds if seconds >= 0 else None  # Also rejects nan.
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 1)
+    except (TypeError, ValueError, IndexError):
+        return None  # Ignore the header.
@@ -0,0 +1,516 @@
+"""
+A control-flow graph over the typed AST and a reaching-uses analysis on it, which computes the
+NEXT_USE edges with a worklist fixpoint over integer bitsets.
+"""
+import heapq
+from typing import Any, Dict, Iterator, List, Tuple
+
+from typed_ast.ast3 import (
+    AST,
+    Assign,
+    AnnAssign,
+    AugAssign,
+    AsyncFor,
+    AsyncFunctionDef,
+    Attribute,
+    BoolOp,
+    Break,
+    ClassDef,
+    Continue,
+    DictComp,
+    ExceptHandler,
+    For,
+    FunctionDef,
+    GeneratorExp,
+    Global,
+    If,
+    IfExp,
+    Lambda,
+    ListComp,
+    Module,
+    Name,
+    Nonlocal,
+    NodeVisitor,
+    Raise,
+    Return,
+    SetComp,
+    Try,
+    While,
+    arg,
+    arguments,
+)
+
+
+class ControlFlowGraph:
+    """
+    The basic blocks of a module, each holding its variable-like uses in evaluation order.
+    Blocks and uses are numbered, so that sets of them can be stored as bitsets.
+    """
+
+    def __init__(self):
+        self.successors = []  # type: List[List[int]]
+        self.block_uses = []  # type: List[List[int]]
+        self.use_nodes = []  # type: List[Any]
+        self.use_symbols = []  # type: List[Any]
+
+    def new_block(self) -> int:
+        self.successors.append([])
+        self.block_uses.append([])
+        return len(self.successors) - 1
+
+    def add_edge(self, from_block: int, to_block: int) -> None:
+        self.successors[from_block].append(to_block)
+
+    def add_use(self, block: int, symbol, node) -> None:
+        self.block_uses[block].append(len(self.use_nodes))
+        self.use_nodes.append(node)
+        self.use_symbols.append(symbol)
+
+    def reverse_postorder(self) -> List[int]:
+        """
+        The blocks in reverse postorder of a depth-first search from the first block, followed by
+        those that it does not reach. A block comes before its successors, except along back-edges.
+        """
+        postorder, visited = [], [False] * len(self.successors)  # type: List[int], List[bool]
+        for root in range(len(self.successors)):
+            if visited[root]:
+                continue
+            visited[root] = True
+            stack = [(root, iter(self.successors[root]))]
+            while len(stack) > 0:
+                block, successors = stack[-1]
+                for successor in successors:
+                    if not visited[successor]:
+                        visited[successor] = True
+                        stack.append((successor, iter(self.successors[successor])))
+                        break
+                else:
+                    postorder.append(block)
+                    stack.pop()
+        postorder.reverse()
+        return postorder
+
+    def predecessors(self) -> List[List[int]]:
+        predecessors = [[] for _ in self.successors]  # type: List[List[int]]
+        for block, successors in enumerate(self.successors):
+            for successor in successors:
+                predecessors[successor].append(block)
+        return predecessors
+
+
+def iter_bits(bitset: int) -> Iterator[int]:
+    """The indices of the bits set, in increasing order."""
+    while bitset:
+        lowest_bit = bitset & -bitset
+        yield lowest_bit.bit_length() - 1
+        bitset ^= lowest_bit
+
+
+class ReachingUses:
+    """
+    For each block, the uses that reach its end without another use of the same symbol in
+    between. The uses of a block replace (kill) the earlier uses of their symbols.
+    """
+
+    def __init__(self, cfg: ControlFlowGraph):
+        self.__cfg = cfg
+        self.symbol_masks = {}  # type: Dict[Any, int]
+        for use, symbol in enumerate(cfg.use_symbols):
+            self.symbol_masks[symbol] = self.symbol_masks.get(symbol, 0) | (1 << use)
+
+        num_blocks = len(cfg.successors)
+        self.__predecessors = cfg.predecessors()
+        generated, kept = [0] * num_blocks, [-1] * num_blocks
+        for block, uses in enumerate(cfg.block_uses):
+            last_use_of = {cfg.use_symbols[use]: use for use in uses}
+            for symbol, use in last_use_of.items():
+                kept[block] &= ~self.symbol_masks[symbol]
+                generated[block] |= 1 << use
+
+        # The worklist is ordered by the reverse postorder, so that a block is usually visited
+        # after all its predecessors, and once more per enclosing loop.
+        order = cfg.reverse_postorder()
+        position = [0] * num_blocks
+        for i, block in enumerate(order):
+            position[block] = i
+        self.reaching_out = list(generated)
+        worklist, queued = list(range(num_blocks)), [True] * num_blocks
+        while len(worklist) > 0:
+            block = order[heapq.heappop(worklist)]
+            queued[block] = False
+            reaching_out = generated[block] | (self.reaching_in(block) & kept[block])
+            if reaching_out == self.reaching_out[block]:
+                continue
+            self.reaching_out[block] = reaching_out
+            for successor in cfg.successors[block]:
+                if not queued[successor]:
+                    queued[successor] = True
+                    heapq.heappush(worklist, position[successor])
+
+    def reaching_in(self, block: int) -> int:
+        reaching = 0
+        for predecessor in self.__predecessors[block]:
+            reaching |= self.reaching_out[predecessor]
+        return reaching
+
+    def next_uses(self) -> Iterator[Tuple[int, int]]:
+        """Each use and the uses of the same symbol that may come next."""
+        cfg = self.__cfg
+        for block, uses in enumerate(cfg.block_uses):
+            if len(uses) == 0:
+                continue
+            reaching = self.reaching_in(block)
+            for use in uses:
+                symbol_mask = self.symbol_masks[cfg.use_symbols[use]]
+                for previous_use in iter_bits(reaching & symbol_mask):
+                    yield previous_use, use
+                reaching = (reaching & ~symbol_mask) | (1 << use)
+
+
+class ControlFlowGraphBuilder(NodeVisitor):
+    """
+    Builds the ControlFlowGraph of a module, from the node and symbol of each variable-like
+    occurrence as recorded by AstGraphGenerator.
+
+    As in DataflowPass, the body of a function is part of the graph where the function is
+    defined, and the statements of a class body are alternatives to each other. Exceptions may
+    be raised before and after each statement of a try body, and break, continue, return and
+    raise go through the enclosing finally bodies.
+    """
+
+    def __init__(self, occurrences: Dict[Any, Tuple[Any, Any]]):
+        self.__occurrences = occurrences
+        self.cfg = ControlFlowGraph()
+        self.__block = self.cfg.new_block()
+
+        # The targets of the jumps, with the number of finally bodies enclosing them.
+        self.__loops = []  # type: List[Tuple[int, int, int]]  # (continue, break, finally depth)
+        self.__returns = []  # type: List[Tuple[int, int]]
+        self.__handlers = []  # type: List[Tuple[List[int], int]]
+        # The entry of each enclosing finally body and the targets of the jumps through it.
+        self.__finally_bodies = []  # type: List[Tuple[int, List[Tuple[int, int]]]]
+
+    def build(self, module: Module) -> ControlFlowGraph:
+        module_exit = self.cfg.new_block()
+        self.__returns.append((module_exit, 0))
+        self.visit(module)
+        self.cfg.add_edge(self.__block, module_exit)
+        self.__returns.pop()
+        return self.cfg
+
+    # region Blocks and jumps
+
+    def __branch_from(self, block: int) -> int:
+        """Start a new block, following the given one."""
+        self.__block = self.cfg.new_block()
+        self.cfg.add_edge(block, self.__block)
+        return self.__block
+
+    def __end_block(self, next_block: int) -> None:
+        self.cfg.add_edge(self.__block, next_block)
+        self.__block = next_block
+
+    def __jump(self, target: int, finally_depth: int) -> None:
+        """Add an edge from the current block to the target, through the enclosing finally bodies."""
+        if len(self.__finally_bodies) > finally_depth:
+            finally_entry, pending_jumps = self.__finally_bodies[-1]
+            self.cfg.add_edge(self.__block, finally_entry)
+            if (target, finally_depth) not in pending_jumps:
+                pending_jumps.append((target, finally_depth))
+        else:
+            self.cfg.add_edge(self.__block, target)
+
+    def __raise(self) -> None:
+        """Jump to the handlers of the innermost try that has some, or out of the function."""
+        for handler_entries, finally_depth in reversed(self.__handlers):
+            if len(handler_entries) > 0:
+                for handler_entry in handler_entries:
+                    self.__jump(handler_entry, finally_depth)
+                return
+        self.__jump(*self.__returns[-1])
+
+    def __unreachable(self) -> None:
+        """The code following a jump starts a new block without predecessors."""
+        self.__block = self.cfg.new_block()
+
+    # endregion
+
+    # region Uses
+
+    def __use(self, key) -> None:
+        occurrence = self.__occurrences.get(key)
+        if occurrence is not None and occurrence[1] is not None:
+            node, symbol = occurrence
+            self.cfg.add_use(self.__block, symbol, node)
+
+    def visit_Name(self, node: Name):
+        self.__use((node, node.id))
+
+    def visit_Attribute(self, node: Attribute):
+        self.__use(node)
+        self.visit(node.value)
+
+    def visit_arg(self, node: arg):
+        self.__use((node, node.arg))
+
+    def visit_Global(self, node: Global):
+        for name in node.names:
+            self.__use((node, name))
+
+    def visit_Nonlocal(self, node: Nonlocal):
+        for name in node.names:
+            self.__use((node, name))
+
+    def visit_Assign(self, node: Assign):
+        self.visit(node.value)
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AugAssign(self, node: AugAssign):
+        self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_AnnAssign(self, node: AnnAssign):
+        if node.value is not None:
+            self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_Dict(self, node):
+        for key, value in zip(node.keys, node.values):
+            if key is not None:
+                self.visit(key)
+            self.visit(value)
+
+    def visit_arguments(self, node: arguments):
+        defaults = [None] * (len(node.args) - len(node.defaults)) + node.defaults
+        for argument, default in zip(node.args, defaults):
+            self.visit(argument)
+            if default is not None:
+                self.visit(default)
+        if node.vararg is not None:
+            self.visit(node.vararg)
+        if node.kwarg is not None:
+            self.visit(node.kwarg)
+        defaults = [None] * (len(node.kwonlyargs) - len(node.kw_defaults)) + node.kw_defaults
+        for argument, default in zip(node.kwonlyargs, defaults):
+            self.visit(argument)
+            if default is not None:
+                self.visit(default)
+
+    # endregion
+
+    # region Control flow
+
+    def __visit_statements(self, statements: List[AST]) -> None:
+        for statement in statements:
+            self.visit(statement)
+
+    def visit_If(self, node: If):
+        self.visit(node.test)
+        test_end, after = self.__block, self.cfg.new_block()
+        self.__branch_from(test_end)
+        self.__visit_statements(node.body)
+        self.__end_block(after)
+        self.__branch_from(test_end)
+        self.__visit_statements(node.orelse)
+        self.__end_block(after)
+
+    def visit_IfExp(self, node: IfExp):
+        self.visit(node.test)
+        test_end, after = self.__block, self.cfg.new_block()
+        for branch in (node.body, node.orelse):
+            self.__branch_from(test_end)
+            self.visit(branch)
+            self.cfg.add_edge(self.__block, after)
+        self.__block = after
+
+    def visit_BoolOp(self, node: BoolOp):
+        after = self.cfg.new_block()
+        for value in node.values[:-1]:
+            self.visit(value)
+            self.cfg.add_edge(self.__block, after)  # Short-circuit
+            self.__branch_from(self.__block)
+        self.visit(node.values[-1])
+        self.__end_block(after)
+
+    def visit_While(self, node: While):
+        head = self.__branch_from(self.__block)
+        self.visit(node.test)
+        test_end, after = self.__block, self.cfg.new_block()
+
+        self.__branch_from(test_end)
+        self.__loops.append((head, after, len(self.__finally_bodies)))
+        self.__visit_statements(node.body)
+        self.__loops.pop()
+        self.cfg.add_edge(self.__block, head)
+
+        self.__branch_from(test_end)
+        self.__visit_statements(node.orelse)
+        self.__end_block(after)
+
+    def visit_For(self, node: For):
+        self.__visit_for(node)
+
+    def visit_AsyncFor(self, node: AsyncFor):
+        self.__visit_for(node)
+
+    def __visit_for(self, node) -> None:
+        self.visit(node.iter)
+        head, after = self.__branch_from(self.__block), self.cfg.new_block()
+
+        self.__branch_from(head)
+        self.visit(node.target)
+        self.__loops.append((head, after, len(self.__finally_bodies)))
+        self.__visit_statements(node.body)
+        self.__loops.pop()
+        self.cfg.add_edge(self.__block, head)
+
+        self.__branch_from(head)
+        self.__visit_statements(node.orelse)
+        self.__end_block(after)
+
+    def visit_Break(self, node: Break):
+        _, break_target, finally_depth = self.__loops[-1]
+        self.__jump(break_target, finally_depth)
+        self.__unreachable()
+
+    def visit_Continue(self, node: Continue):
+        continue_target, _, finally_depth = self.__loops[-1]
+        self.__jump(continue_target, finally_depth)
+        self.__unreachable()
+
+    def visit_Return(self, node: Return):
+        if node.value is not None:
+            self.visit(node.value)
+        self.__jump(*self.__returns[-1])
+        self.__unreachable()
+
+    def visit_Raise(self, node: Raise):
+        if node.exc is not None:
+            self.visit(node.exc)
+        if node.cause is not None:
+            self.visit(node.cause)
+        self.__raise()
+        self.__unreachable()
+
+    def visit_Try(self, node: Try):
+        after = self.cfg.new_block()
+        if len(node.finalbody) > 0:
+            self.__finally_bodies.append((self.cfg.new_block(), []))
+        handler_entries = [self.cfg.new_block() for _ in node.handlers]
+
+        self.__handlers.append((handler_entries, len(self.__finally_bodies)))
+        self.__raise()
+        for statement in node.body:
+            self.visit(statement)
+            self.__raise()
+        self.__handlers.pop()
+        self.__visit_statements(node.orelse)
+
+        ends = [self.__block]
+        for handler, handler_entry in zip(node.handlers, handler_entries):
+            self.__block = handler_entry
+            self.visit(handler)
+            ends.append(self.__block)
+
+        if len(node.finalbody) > 0:
+            finally_entry, pending_jumps = self.__finally_bodies.pop()
+            for end in ends:
+                self.cfg.add_edge(end, finally_entry)
+            self.__block = finally_entry
+            self.__visit_statements(node.finalbody)
+            ends = [self.__block]
+            for target, finally_depth in pending_jumps:
+                self.__jump(target, finally_depth)
+
+        for end in ends:
+            self.cfg.add_edge(end, after)
+        self.__block = after
+
+    def visit_ExceptHandler(self, node: ExceptHandler):
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name is not None:
+            self.__use((node, node.name))
+        self.__visit_statements(node.body)
+
+    # endregion
+
+    # region Scopes
+
+    def visit_FunctionDef(self, node: FunctionDef):
+        self.__visit_function(node)
+
+    def visit_AsyncFunctionDef(self, node: AsyncFunctionDef):
+        self.__visit_function(node)
+
+    def __visit_function(self, node) -> None:
+        self.__visit_statements(node.decorator_list)
+        self.visit(node.args)
+
+        outer_jump_targets = self.__loops, self.__returns, self.__handlers, self.__finally_bodies
+        function_exit = self.cfg.new_block()
+        self.__loops, self.__returns, self.__handlers, self.__finally_bodies = (
+            [],
+            [(function_exit, 0)],
+            [],
+            [],
+        )
+        self.__visit_statements(node.body)
+        self.__end_block(function_exit)
+        self.__loops, self.__returns, self.__handlers, self.__finally_bodies = outer_jump_targets
+
+    def visit_Lambda(self, node: Lambda):
+        self.visit(node.args)
+        self.visit(node.body)
+
+    def visit_ClassDef(self, node: ClassDef):
+        self.__visit_statements(node.decorator_list)
+        self.__visit_statements(node.bases)
+        self.__visit_statements(node.keywords)
+        class_entry, after = self.__block, self.cfg.new_block()
+        for statement in node.body:
+            self.__branch_from(class_entry)
+            self.visit(statement)
+            self.cfg.add_edge(self.__block, after)
+        self.__block = after
+
+    def visit_ListComp(self, node: ListComp):
+        self.__visit_generators(node.generators, [node.elt])
+
+    def visit_SetComp(self, node: SetComp):
+        self.__visit_generators(node.generators, [node.elt])
+
+    def visit_GeneratorExp(self, node: GeneratorExp):
+        self.__visit_generators(node.generators, [node.elt])
+
+    def visit_DictComp(self, node: DictComp):
+        self.__visit_generators(node.generators, [node.key, node.value])
+
+    def __visit_generators(self, generators, elements: List[AST]) -> None:
+        """Each generator is a loop, nested in the previous one."""
+        generator = generators[0]
+        self.visit(generator.iter)
+        head = self.__branch_from(self.__block)
+        self.__branch_from(head)
+        self.visit(generator.target)
+        for condition in generator.ifs:
+            self.visit(condition)
+            self.cfg.add_edge(self.__block, head)
+            self.__branch_from(self.__block)
+
+        if len(generators) > 1:
+            self.__visit_generators(generators[1:], elements)
+        else:
+            self.__visit_statements(elements)
+        self.cfg.add_edge(self.__block, head)
+        self.__branch_from(head)
+
+    # endregion
+
+
+def next_use_edges(module: Module, occurrences: Dict[Any, Tuple[Any, Any]]) -> Iterator[Tuple]:
+    """The NEXT_USE edges of a module, as pairs of nodes."""
+    cfg = ControlFlowGraphBuilder(occurrences).build(module)
+    for use, next_use in ReachingUses(cfg).next_uses():
+        yield cfg.use_nodes[use], cfg.use_nodes[next_use]
@@ -1,7 +1,5 @@
-from collections import defaultdict
 from itertools import chain
-from symtable import SymbolTable
-from typing import Any, Dict, Optional, Set, Union, List
+from typing import Any, Dict, FrozenSet, Iterator, Optional, Set, Tuple, Union, List
 
 
 from typed_ast.ast3 import (
@@ -47,23 +45,144 @@ from typed_ast.ast3 import (
 
 from .graphgenutils import EdgeType
 
+_NO_USES = frozenset()  # type: FrozenSet[Any]
+
+
+class LastUses:
+    """
+    A persistent map from each symbol to the nodes of its last uses.
+
+    Each fork at a control-flow point freezes the current map and starts a new layer on top of
+    it, holding the symbols whose uses change in it. Forking is O(1), and merging two maps only
+    visits the layers and symbols that changed since their common ancestor.
+
+    For the lookups, a layer at depth d also holds the uses of the layers down to the depth
+    d & (d - 1), so at most log2(d) layers are visited.
+    """
+
+    __slots__ = ("__uses", "__changes", "__parent", "__base", "__root", "__depth", "__frozen")
+
+    def __init__(self, parent: Optional["LastUses"] = None):
+        self.__uses = {}  # type: Dict[Any, FrozenSet[Any]]
+        self.__changes = set()  # type: Set[Any]
+        self.__parent = parent
+        self.__frozen = False
+        if parent is None:
+            self.__base, self.__root, self.__depth = None, self, 0
+            return
+
+        parent.__frozen = True
+        self.__root = parent.__root
+        self.__depth = parent.__depth + 1
+        base_depth = self.__depth & (self.__depth - 1)
+        base, squashed = parent, []
+        while base.__depth > base_depth:
+            squashed.append(base)
+            base = base.__base
+        for layer in reversed(squashed):
+            self.__uses.update(layer.__uses)
+        self.__base = base
+
+    def __lookup_layers(self) -> Iterator["LastUses"]:
+        layer = self
+        while layer is not None:
+            yield layer
+            layer = layer.__base
+
+    def get(self, symbol) -> FrozenSet[Any]:
+        layer = self
+        while layer is not None:
+            nodes = layer.__uses.get(symbol)
+            if nodes is not None:
+                return nodes
+            layer = layer.__base
+        return _NO_USES
+
+    def set(self, symbol, nodes: FrozenSet[Any]) -> "LastUses":
+        """Set the last uses of a symbol, in a new layer if this one is frozen. Returns the layer."""
+        layer = LastUses(self) if self.__frozen else self
+        layer.__uses[symbol] = nodes
+        layer.__changes.add(symbol)
+        return layer
+
+    def fork(self) -> "LastUses":
+        return LastUses(self)
+
+    def items(self) -> Iterator[Tuple[Any, FrozenSet[Any]]]:
+        uses = {}
+        for layer in reversed(list(self.__lookup_layers())):
+            uses.update(layer.__uses)
+        return iter(uses.items())
+
+    @staticmethod
+    def merge(uses1: "LastUses", uses2: "LastUses") -> "LastUses":
+        """The union of the last uses of each symbol."""
+        if uses1.__root is uses2.__root:
+            changed_symbols = set()
+            layer1, layer2 = uses1, uses2
+            while layer1 is not layer2:
+                if layer1.__depth >= layer2.__depth:
+                    changed_symbols |= layer1.__changes
+                    layer1 = layer1.__parent
+                else:
+                    changed_symbols |= layer2.__changes
+                    layer2 = layer2.__parent
+            merged = LastUses(layer1)
+        else:
+            # Unrelated maps, e.g. after a return. Add the smaller one to the larger one.
+            size1 = sum(len(layer.__uses) for layer in uses1.__lookup_layers())
+            size2 = sum(len(layer.__uses) for layer in uses2.__lookup_layers())
+            if size1 < size2:
+                uses1, uses2 = uses2, uses1
+            changed_symbols = {symbol for symbol, _ in uses2.items()}
+            merged = LastUses(uses1)
+
+        for symbol in changed_symbols:
+            nodes1, nodes2 = uses1.get(symbol), uses2.get(symbol)
+            if nodes1 >= nodes2:
+                merged.__uses[symbol] = nodes1
+            elif nodes2 >= nodes1:
+                merged.__uses[symbol] = nodes2
+            else:
+                merged.__uses[symbol] = nodes1 | nodes2
+        merged.__changes = changed_symbols
+        return merged
+
 
 class DataflowPass(NodeVisitor):
-    def __init__(self, ast_graph_generator):
+    def __init__(
+        self, ast_graph_generator, occurrences: Optional[Dict[Any, Tuple[Any, Any]]] = None
+    ):
+        """
+        The occurrences are the node and symbol of each variable-like occurrence, as recorded by
+        the ast_graph_generator. If None, they are found by querying the edges of the graph.
+        """
         self.__graph_generator = ast_graph_generator
+        self.__occurrences = occurrences
 
         # Last Use
-        self.__last_use: Dict[Any, Set[Any]] = defaultdict(set)
+        self.__last_use = LastUses()
 
-        self.__break_uses: Dict[Any, Set[Any]] = defaultdict(set)
-        self.__continue_uses: Dict[Any, Set[Any]] = defaultdict(set)
-        self.__return_uses: Dict[Any, Set[Any]] = defaultdict(set)
+        self.__break_uses = LastUses()
+        self.__continue_uses = LastUses()
+        self.__return_uses = LastUses()
 
     def __visit_variable_like(self, name: Union[str, AST], parent_node: Optional[AST]):
         if isinstance(name, Name):
             self.visit(name)
             return
 
+        if self.__occurrences is not None:
+            key = name if isinstance(name, AST) else (parent_node, name)
+            occurrence = self.__occurrences.get(key)
+            if occurrence is None:
+                assert isinstance(name, AST)
+                return
+            node, symbol = occurrence
+            if symbol is not None:
+                self.__record_next_use(symbol, node)
+            return
+
         if isinstance(name, AST):
             node = name
         else:
@@ -102,17 +221,13 @@ class DataflowPass(NodeVisitor):
 
     def __visit_function(self, node: Union[FunctionDef, AsyncFunctionDef], is_async: bool):
         outer_return_uses = self.__return_uses
-        self.__return_uses = defaultdict(set)
+        self.__return_uses = LastUses()
 
-        before_function_uses = self.__clone_last_uses()
         self.visit(node.args)
         self.__visit_statement_block(node.body)
 
-        # Merge used variables in a dummy return value *only* if they have been accessed within the function.
+        # Merge used variables in a dummy return value.
         self.__last_use = self.__merge_uses(self.__last_use, self.__return_uses)
-        for symbol, last_uses in self.__last_use.items():
-            if before_function_uses[symbol] == last_uses:
-                continue
 
         self.__return_uses = outer_return_uses
 
@@ -121,28 +236,18 @@ class DataflowPass(NodeVisitor):
     # region ControlFlow
 
     def __record_next_use(self, symbol, node) -> None:
-        for last_node_used in self.__last_use[symbol]:
+        for last_node_used in self.__last_use.get(symbol):
             self.__graph_generator._add_edge(last_node_used, node, EdgeType.NEXT_USE)
-        self.__last_use[symbol] = {node}
-
-    def __merge_uses(
-        self, use_set1: Dict[Any, Set[Any]], use_set2: Dict[Any, Set[Any]]
-    ) -> Dict[Any, Set[Any]]:
-        merged = defaultdict(set)
-        for symbol, last_used_nodes in chain(use_set1.items(), use_set2.items()):
-            merged[symbol] |= last_used_nodes
-        return merged
+        self.__last_use = self.__last_use.set(symbol, frozenset((node,)))
+
+    def __merge_uses(self, use_set1: LastUses, use_set2: LastUses) -> LastUses:
+        return LastUses.merge(use_set1, use_set2)
 
-    def __clone_last_uses(self) -> Dict[Any, Set[Any]]:
-        cloned = defaultdict(set)
-        for symbol, last_used_nodes in self.__last_use.items():
-            cloned[symbol] = set(last_used_nodes)
-        return cloned
+    def __clone_last_uses(self) -> LastUses:
+        return self.__last_use.fork()
 
     def __loop_back_after(
-        self,
-        last_uses_at_end_of_loop: Dict[Any, Set[Any]],
-        last_uses_just_before_looping_point: Dict[Any, Set[Any]],
+        self, last_uses_at_end_of_loop: LastUses, last_uses_just_before_looping_point: LastUses,
     ) -> None:
         for (symbol, last_use_before_looping_point,) in last_uses_just_before_looping_point.items():
             first_use_after_looping_point = set(
@@ -154,17 +259,17 @@ class DataflowPass(NodeVisitor):
                 )
             )
 
-            for from_node in last_uses_at_end_of_loop[symbol]:
+            for from_node in last_uses_at_end_of_loop.get(symbol):
                 for to_node in first_use_after_looping_point:
                     self.__graph_generator._add_edge(from_node, to_node, EdgeType.NEXT_USE)
 
     def visit_Break(self, node: Break):
         self.__break_uses = self.__merge_uses(self.__break_uses, self.__last_use)
-        self.__last_use = defaultdict(set)
+        self.__last_use = LastUses()
 
     def visit_Continue(self, node: Continue):
         self.__continue_uses = self.__merge_uses(self.__last_use, self.__continue_uses)
-        self.__last_use = defaultdict(set)
+        self.__last_use = LastUses()
 
     def visit_For(self, node: For):
         self.__visit_for(node, False)
@@ -238,7 +343,7 @@ class DataflowPass(NodeVisitor):
 
     def __visit_return_like(self):
         self.__return_uses = self.__merge_uses(self.__return_uses, self.__last_use)
-        self.__last_use = defaultdict(set)
+        self.__last_use = LastUses()
 
     def visit_Try(self, node: Try):
         # Heuristic: each handler is an if-like statement
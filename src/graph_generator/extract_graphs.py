@@ -1,5 +1,19 @@
-from typing import Tuple, List, Optional, Set, Iterator
+"""
+Extract the graphs of all the Python files in a folder, e.g. to create a dataset.
+
+Usage:
+    extract_graphs.py [options] ROOT_DIR TYPING_RULES TARGET_FOLDER
+
+Options:
+    --debug                    Enable debug routines. [default: False]
+    --jobs=J                   The number of worker processes extracting graphs. [default: 1]
+    -h --help                  Show this screen.
+"""
+
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Tuple, List, Optional, Set, Iterator
 from dpu_utils.utils import save_jsonl_gz, run_and_debug, ChunkWriter
+import multiprocessing
 import traceback
 import os
 from glob import iglob
@@ -7,9 +21,10 @@ from glob import iglob
 from docopt import docopt
 import time
 
-from .graphgenerator import AstGraphGenerator
+from .graphgenerator import AstGraphGenerator, find_type_aliases
+from .phasetimings import timings
 from .type_lattice_generator import TypeLatticeGenerator
-from .typeparsing import FaultyAnnotation
+from .typeparsing import FaultyAnnotation, TypeAnnotationNode, parse_cache_stats
 
 
 class Monitoring:
@@ -19,6 +34,7 @@ class Monitoring:
         self.file = ""  # type: str
         self.current_repo = ""
         self.empty_files = []
+        self.unresolved_names = Counter()  # type: Counter[str]
 
     def increment_count(self) -> None:
         self.count += 1
@@ -33,15 +49,100 @@ class Monitoring:
         self.current_repo = repo_name
 
 
+class RecordingTypeLattice:
+    """
+    Used by the worker processes in place of their TypeLatticeGenerator. The calls that add to
+    the lattice are recorded, so that the main process can replay them on its own lattice in
+    the same order as a serial extraction. Only type aliases are added to the worker lattice,
+    since they are needed to canonicalize the annotations.
+    """
+
+    def __init__(self, type_lattice: TypeLatticeGenerator):
+        self.__type_lattice = type_lattice
+        self.operations = []  # type: List[Tuple[str, Tuple]]
+
+    def add_type(
+        self,
+        annotation: TypeAnnotationNode,
+        imported_symbols: Dict[TypeAnnotationNode, TypeAnnotationNode],
+    ) -> None:
+        self.operations.append(("add_type", (annotation, dict(imported_symbols))))
+
+    def add_class(self, class_name: str, parents: List[TypeAnnotationNode]) -> None:
+        self.operations.append(("add_class", (class_name, parents)))
+
+    def add_type_alias(
+        self, new_annotation: TypeAnnotationNode, ref_annotation: TypeAnnotationNode
+    ) -> None:
+        self.operations.append(("add_type_alias", (new_annotation, ref_annotation)))
+        self.__type_lattice.add_type_alias(new_annotation, ref_annotation)
+
+    def canonicalize_annotation(
+        self,
+        annotation: TypeAnnotationNode,
+        local_aliases: Dict[TypeAnnotationNode, TypeAnnotationNode],
+    ) -> Optional[TypeAnnotationNode]:
+        return self.__type_lattice.canonicalize_annotation(annotation, local_aliases)
+
+    @staticmethod
+    def replay(operations: List[Tuple[str, Tuple]], type_lattice: TypeLatticeGenerator) -> None:
+        for method_name, method_args in operations:
+            getattr(type_lattice, method_name)(*method_args)
+
+
+class AliasOnlyTypeLattice:
+    """
+    Used in place of a TypeLatticeGenerator when the lattice itself is not needed, e.g. for
+    inference. The annotations are still canonicalized through the aliases of the typing rules
+    and of the project, but the types and classes are dropped, so the erasures, the inheritance
+    rewriting and the is-a edges are never computed.
+    """
+
+    def __init__(self, type_lattice: TypeLatticeGenerator):
+        self.__type_lattice = type_lattice
+
+    def add_type(
+        self,
+        annotation: TypeAnnotationNode,
+        imported_symbols: Dict[TypeAnnotationNode, TypeAnnotationNode],
+    ) -> None:
+        pass
+
+    def add_class(self, class_name: str, parents: List[TypeAnnotationNode]) -> None:
+        pass
+
+    def add_type_alias(
+        self, new_annotation: TypeAnnotationNode, ref_annotation: TypeAnnotationNode
+    ) -> None:
+        self.__type_lattice.add_type_alias(new_annotation, ref_annotation)
+
+    def canonicalize_annotation(
+        self,
+        annotation: TypeAnnotationNode,
+        local_aliases: Dict[TypeAnnotationNode, TypeAnnotationNode],
+    ) -> Optional[TypeAnnotationNode]:
+        return self.__type_lattice.canonicalize_annotation(annotation, local_aliases)
+
+    def build_graph(self) -> None:
+        pass
+
+
 def build_graph(
-    source_code, monitoring: Monitoring, type_lattice: TypeLatticeGenerator
+    source_code,
+    monitoring: Monitoring,
+    type_lattice: TypeLatticeGenerator,
+    lines_of_interest: Optional[Set[int]] = None,
+    symbol_kinds: Optional[FrozenSet[str]] = None,
 ) -> Tuple[Optional[List], Optional[List]]:
     """
     Parses the code of a file into a custom abstract syntax tree.
     """
     try:
-        visitor = AstGraphGenerator(source_code, type_lattice)
-        return visitor.build()
+        with timings.phase("build_graph"):
+            visitor = AstGraphGenerator(source_code, type_lattice, lines_of_interest, symbol_kinds)
+            graph = visitor.build()
+        monitoring.unresolved_names.update(visitor.unresolved_names)
+        return graph
     except FaultyAnnotation as e:
         print("Faulty Annotation: ", e)
         print("at file: ", monitoring.file)
@@ -52,73 +153,287 @@ def build_graph(
         monitoring.found_error(e, traceback.format_exc())
 
 
+def _find_python_files(root_dir: str) -> List[str]:
+    with timings.phase("file discovery"):
+        return [
+            file_path
+            for file_path in iglob(os.path.join(root_dir, "**", "*.py"), recursive=True)
+            if os.path.isfile(file_path)
+        ]
+
+
 def explore_files(
     root_dir: str,
-    files_to_extract: Set[str],
+    files_to_extract: Optional[Set[str]],
     monitoring: Monitoring,
     type_lattice: TypeLatticeGenerator,
+    lines_of_interest: Optional[Dict[str, Set[int]]] = None,
+    symbol_kinds: Optional[FrozenSet[str]] = None,
 ) -> Iterator[Tuple]:
     """
-    Walks through the root_dir and process each file.
+    Walks through the root_dir and process each file. If files_to_extract is None all files are processed.
+    If lines_of_interest is given, only the supernodes in the given lines of each file are emitted.
     """
-    for file_path in iglob(os.path.join(root_dir, "**", "*.py"), recursive=True):
-        if not os.path.isfile(file_path):
-            continue
+    for file_path in _find_python_files(root_dir):
         with open(file_path, encoding="utf-8", errors="ignore") as f:
             monitoring.increment_count()
             monitoring.enter_file(file_path)
 
             # import pdb; pdb.set_trace()
-            if file_path[len(root_dir) :] not in files_to_extract:
+            if files_to_extract is not None and file_path[len(root_dir) :] not in files_to_extract:
                 continue
 
-            graph = build_graph(f.read(), monitoring, type_lattice)
+            relative_path = file_path[len(root_dir) :]
+            graph = build_graph(
+                f.read(),
+                monitoring,
+                type_lattice,
+                lines_of_interest=None
+                if lines_of_interest is None
+                else lines_of_interest.get(relative_path, set()),
+                symbol_kinds=symbol_kinds,
+            )
             if graph is None or len(graph["supernodes"]) == 0:
                 continue
-            graph["filename"] = file_path[len(root_dir) :]
+            graph["filename"] = relative_path
             yield graph
-    type_lattice.build_graph()
+    with timings.phase("type lattice build"):
+        type_lattice.build_graph()
+
+
+_worker_type_lattice = None  # type: Optional[TypeLatticeGenerator]
+_worker_builds_type_lattice = True
+# The type aliases of all the files, in the order of a serial extraction.
+_worker_type_aliases = []  # type: List[Tuple[TypeAnnotationNode, TypeAnnotationNode]]
+# How many of the first _worker_type_aliases are in the worker lattice, or -1 if it has others.
+_worker_num_type_aliases = 0
+
 
+def _init_worker(
+    typing_rules_path: str,
+    build_type_lattice: bool,
+    type_aliases: List[Tuple[TypeAnnotationNode, TypeAnnotationNode]],
+) -> None:
+    global _worker_type_lattice, _worker_builds_type_lattice, _worker_type_aliases
+    _worker_type_lattice = TypeLatticeGenerator(typing_rules_path)
+    _worker_builds_type_lattice = build_type_lattice
+    _worker_type_aliases = type_aliases
 
-def extract_graphs(root_dir, typing_rules_path, files_to_extract: Set[str], target_folder):
+
+def _load_type_aliases(num_type_aliases: int) -> None:
+    """Make the worker lattice have exactly the first num_type_aliases type aliases."""
+    global _worker_num_type_aliases
+    if _worker_num_type_aliases < 0 or _worker_num_type_aliases > num_type_aliases:
+        _worker_type_lattice.clear_type_aliases()
+        _worker_num_type_aliases = 0
+    for new_annotation, ref_annotation in _worker_type_aliases[
+        _worker_num_type_aliases:num_type_aliases
+    ]:
+        _worker_type_lattice.add_type_alias(new_annotation, ref_annotation)
+    _worker_num_type_aliases = num_type_aliases
+
+
+def _build_graph_in_worker(args) -> Tuple[Optional[Dict[str, Any]], List, Monitoring, Dict]:
+    global _worker_num_type_aliases
+    file_path, relative_path, lines_of_interest, symbol_kinds, type_aliases = args
+    # The aliases of the previous files, as in a serial extraction. This file adds its own.
+    _load_type_aliases(type_aliases.start)
+    if type_aliases.stop > type_aliases.start:
+        _worker_num_type_aliases = -1
+    timings.phases = {}  # Only send back the timings of this file.
+    monitoring = Monitoring()
+    monitoring.enter_file(file_path)
+    if _worker_builds_type_lattice:
+        type_lattice = RecordingTypeLattice(_worker_type_lattice)
+    else:
+        type_lattice = AliasOnlyTypeLattice(_worker_type_lattice)
+    with open(file_path, encoding="utf-8", errors="ignore") as f:
+        graph = build_graph(f.read(), monitoring, type_lattice, lines_of_interest, symbol_kinds)
+    if graph is not None:
+        graph["filename"] = relative_path
+    operations = type_lattice.operations if _worker_builds_type_lattice else []
+    return graph, operations, monitoring, timings.phases
+
+
+def explore_files_parallel(
+    root_dir: str,
+    files_to_extract: Optional[Set[str]],
+    monitoring: Monitoring,
+    type_lattice: TypeLatticeGenerator,
+    typing_rules_path: str,
+    jobs: int,
+    lines_of_interest: Optional[Dict[str, Set[int]]] = None,
+    symbol_kinds: Optional[FrozenSet[str]] = None,
+    build_type_lattice: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Same as explore_files, but the graphs are built by a pool of jobs worker processes.
+
+    The graphs are yielded and the additions to the type_lattice are replayed in the same order
+    as explore_files, so the results are the same. In particular, the project-specific type
+    aliases (NewType) of the files are found before the workers start, and each file is
+    canonicalized with the aliases of the files before it and its own, as in explore_files.
+    Without build_type_lattice, the workers only canonicalize the annotations and there is
+    nothing to replay.
+    """
+    file_paths = _find_python_files(root_dir)
+    type_aliases = []  # type: List[Tuple[TypeAnnotationNode, TypeAnnotationNode]]
+    tasks = []
+    for file_path in file_paths:
+        relative_path = file_path[len(root_dir) :]
+        if files_to_extract is not None and relative_path not in files_to_extract:
+            continue
+        with open(file_path, encoding="utf-8", errors="ignore") as f:
+            num_type_aliases = len(type_aliases)
+            type_aliases.extend(find_type_aliases(f.read()))
+        tasks.append(
+            (
+                file_path,
+                relative_path,
+                None if lines_of_interest is None else lines_of_interest.get(relative_path, set()),
+                symbol_kinds,
+                range(num_type_aliases, len(type_aliases)),
+            )
+        )
+    monitoring.count += len(file_paths)
+
+    # Fork, so that the workers do not re-import the __main__ module (e.g. the entrypoint).
+    with multiprocessing.get_context("fork").Pool(
+        jobs,
+        initializer=_init_worker,
+        initargs=(typing_rules_path, build_type_lattice, type_aliases),
+    ) as pool:
+        for graph, operations, worker_monitoring, phases in pool.imap(
+            _build_graph_in_worker, tasks
+        ):
+            RecordingTypeLattice.replay(operations, type_lattice)
+            monitoring.errors.extend(worker_monitoring.errors)
+            monitoring.unresolved_names.update(worker_monitoring.unresolved_names)
+            timings.merge(phases)
+            if graph is None or len(graph["supernodes"]) == 0:
+                continue
+            yield graph
+    with timings.phase("type lattice build"):
+        type_lattice.build_graph()
+
+
+def iter_graphs(
+    root_dir: str,
+    typing_rules_path: str,
+    files_to_extract: Optional[Set[str]],
+    target_folder: Optional[str] = None,
+    type_lattice: Optional[TypeLatticeGenerator] = None,
+    lines_of_interest: Optional[Dict[str, Set[int]]] = None,
+    symbol_kinds: Optional[FrozenSet[str]] = None,
+    jobs: int = 1,
+    build_type_lattice: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the graphs of the files in memory. When a target_folder is given the graphs, the
+    type lattice and the error logs are also saved there (e.g. for debugging or for datasets).
+
+    lines_of_interest and symbol_kinds restrict the supernodes of each graph (and hence what the
+    model has to predict) to the symbols that can actually be suggested. With jobs > 1 the graphs
+    are built in parallel by worker processes, see explore_files_parallel.
+
+    The graphs do not depend on the type lattice, which is only needed for datasets. Without
+    build_type_lattice (e.g. for inference) the annotations are canonicalized but the lattice is
+    neither built nor saved, see AliasOnlyTypeLattice.
+    """
     start_time = time.time()
     print("Traversing folders ...")
     monitoring = Monitoring()
-    type_lattice = TypeLatticeGenerator(typing_rules_path)
+    if type_lattice is None:
+        type_lattice = TypeLatticeGenerator(typing_rules_path)
+    if not build_type_lattice:
+        type_lattice = AliasOnlyTypeLattice(type_lattice)
 
     # Extract graphs
-    outputs = explore_files(root_dir, files_to_extract, monitoring, type_lattice)
-
-    # Save results
-    with ChunkWriter(
-        out_folder=target_folder,
-        file_prefix="all-graphs",
-        max_chunk_size=5000,
-        file_suffix=".jsonl.gz",
-    ) as writer:
-        for graph in outputs:
-            writer.add(graph)
-
-    print("Building and saving the type graph...")
-    type_lattice.build_graph()
-    save_jsonl_gz(
-        [type_lattice.return_json()], os.path.join(target_folder, "_type_lattice.json.gz"),
-    )
+    if jobs > 1:
+        outputs = explore_files_parallel(
+            root_dir,
+            files_to_extract,
+            monitoring,
+            type_lattice,
+            typing_rules_path,
+            jobs,
+            lines_of_interest,
+            symbol_kinds,
+            build_type_lattice,
+        )
+    else:
+        outputs = explore_files(
+            root_dir, files_to_extract, monitoring, type_lattice, lines_of_interest, symbol_kinds
+        )
+
+    if target_folder is None:
+        yield from outputs
+    else:
+        with ChunkWriter(
+            out_folder=target_folder,
+            file_prefix="all-graphs",
+            max_chunk_size=5000,
+            file_suffix=".jsonl.gz",
+        ) as writer:
+            for graph in outputs:
+                writer.add(graph)
+                yield graph
+
+        # The type lattice was built once all the graphs were extracted.
+        if build_type_lattice:
+            print("Saving the type graph...")
+            save_jsonl_gz(
+                [type_lattice.return_json()], os.path.join(target_folder, "_type_lattice.json.gz"),
+            )
+
+        with open(os.path.join(target_folder, "logs_graph_generator.txt"), "w") as f:
+            for item in monitoring.errors:
+                try:
+                    f.write("%s\n" % item)
+                except:
+                    pass
+            for name, count in monitoring.unresolved_names.most_common():
+                f.write(f"Unresolved name {name}: {count} occurrences\n")
 
     print("Done.")
     print(
         "Generated %d graphs out of %d snippets"
         % (monitoring.count - len(monitoring.errors), monitoring.count)
     )
+    print(
+        "%d occurrences of %d names could not be resolved"
+        % (sum(monitoring.unresolved_names.values()), len(monitoring.unresolved_names))
+    )
+    parse_cache = parse_cache_stats()
+    print(
+        "Parsed %d annotation strings in this process, %.1f%% from the cache"
+        % (parse_cache["hits"] + parse_cache["misses"], 100 * parse_cache["hit_rate"])
+    )
+    print("\nGraph Execution in: ", time.time() - start_time, " seconds")
 
-    with open(os.path.join(target_folder, "logs_graph_generator.txt"), "w") as f:
-        for item in monitoring.errors:
-            try:
-                f.write("%s\n" % item)
-            except:
-                pass
 
-    print("\nGraph Execution in: ", time.time() - start_time, " seconds")
+def extract_graphs(
+    root_dir,
+    typing_rules_path,
+    files_to_extract: Optional[Set[str]],
+    target_folder,
+    type_lattice: Optional[TypeLatticeGenerator] = None,
+    jobs: int = 1,
+):
+    for _ in iter_graphs(
+        root_dir, typing_rules_path, files_to_extract, target_folder, type_lattice, jobs=jobs
+    ):
+        pass
+
+
+def main(args):
+    extract_graphs(
+        args["ROOT_DIR"],
+        args["TYPING_RULES"],
+        files_to_extract=None,
+        target_folder=args["TARGET_FOLDER"],
+        jobs=int(args["--jobs"]),
+    )
 
 
 if __name__ == "__main__":
@@ -1,9 +1,8 @@
 import keyword
 import logging
 import re
-from collections import defaultdict
-from symtable import symtable, Symbol
-from typing import Any, Dict, Optional, Set, Union, List, FrozenSet
+from collections import Counter
+from typing import Any, Dict, Optional, Set, Tuple, Union, List, FrozenSet
 
 from dpu_utils.codeutils import split_identifier_into_parts
 from dpu_utils.utils import run_and_debug
@@ -73,10 +72,14 @@ from typed_ast.ast3 import (
     Raise,
     IfExp,
     Call,
+    walk,
 )
 
+from .controlflow import next_use_edges
 from .dataflowpass import DataflowPass
-from .graphgenutils import EdgeType, TokenNode, StrSymbol, SymbolInformation
+from .graphgenutils import EdgeStore, EdgeType, TokenNode, StrSymbol, SymbolInformation
+from .phasetimings import timings
+from .scopeanalysis import Scope, ScopeSymbol, analyze_scopes
 from .type_lattice_generator import TypeLatticeGenerator
 from .typeparsing import (
     parse_type_annotation_node,
@@ -84,19 +87,90 @@ from .typeparsing import (
     TypeAnnotationNode,
 )
 
+# Bump when the generated graphs change, e.g. to invalidate cached predictions.
+GRAPH_GENERATOR_VERSION = 2
+
+# The symbol that a name resolves to and its symbol type, or (None, None).
+ResolvedName = Tuple[Optional[ScopeSymbol], Optional[str]]
+
+
+def _is_new_type(node: Assign) -> bool:
+    return (
+        hasattr(node, "value")
+        and hasattr(node.value, "func")
+        and hasattr(node.value.func, "id")
+        and node.value.func.id == "NewType"
+        and hasattr(node, "value")
+        and hasattr(node.value, "args")
+        and len(node.value.args) == 2
+    )
+
+
+def find_type_aliases(source: str) -> List[Tuple[TypeAnnotationNode, TypeAnnotationNode]]:
+    """
+    The type aliases (NewType) that AstGraphGenerator adds to the type lattice for the source,
+    in the order of the source, without building its graph.
+    """
+    if "NewType" not in source:
+        return []
+    try:
+        tree = parse(source)
+    except SyntaxError:
+        return []
+    new_types = [node for node in walk(tree) if isinstance(node, Assign) and _is_new_type(node)]
+    new_types.sort(key=lambda node: (node.lineno, node.col_offset))
+    return [
+        (
+            parse_type_annotation_node(node.value.args[0]),
+            parse_type_annotation_node(node.value.args[1]),
+        )
+        for node in new_types
+    ]
+
 
 class AstGraphGenerator(NodeVisitor):
-    def __init__(self, source: str, type_graph: TypeLatticeGenerator):
+    def __init__(
+        self,
+        source: str,
+        type_graph: TypeLatticeGenerator,
+        lines_of_interest: Optional[Set[int]] = None,
+        symbol_kinds: Optional[FrozenSet[str]] = None,
+        two_pass_dataflow: bool = False,
+        cfg_dataflow: bool = False,
+    ):
+        """
+        When lines_of_interest or symbol_kinds are given, only the supernodes located in these
+        lines and of these kinds (e.g. "parameter") are emitted. The rest of the graph is unchanged.
+
+        By default, the dataflow pass reuses the symbols resolved while visiting the AST. With
+        two_pass_dataflow, it finds them again by querying the CHILD and OCCURRENCE_OF edges, as
+        it used to. Both produce the same graph, the latter is kept for validation.
+
+        With cfg_dataflow, the NEXT_USE edges are instead computed by a reaching-uses analysis
+        over the control-flow graph of the module (see controlflow.py). It takes near-linear time
+        on loop-heavy code, but its edges differ from those of DataflowPass, on which the models
+        were trained: the loops, short-circuits and exceptions are modelled exactly.
+        """
         self.__type_graph = type_graph
+        self.__lines_of_interest = lines_of_interest
+        self.__symbol_kinds = symbol_kinds
+        self.__two_pass_dataflow = two_pass_dataflow
+        self.__cfg_dataflow = cfg_dataflow
         self.__node_to_id: Dict[Any, int] = {}
         self.__id_to_node: List[Any] = []
 
-        self.__symbol_to_supernode_id: Dict[Symbol, int] = {}
+        self.__symbol_to_supernode_id: Dict[ScopeSymbol, int] = {}
 
-        self.__edges: Dict[EdgeType, Dict[int, Set[int]]] = {e: defaultdict(set) for e in EdgeType}
+        self.__edges: Dict[EdgeType, EdgeStore] = {e: EdgeStore() for e in EdgeType}
 
         self.__ast = parse(source)
-        self.__scope_symtable = [symtable(source, "file.py", "exec")]
+        self.__scope_symtable = [analyze_scopes(self.__ast)]
+        # For each scope entered, the symbol and symbol type that each name resolves to.
+        self.__scope_resolution: Dict[Scope, Dict[str, ResolvedName]] = {}
+        self.__enter_scope_resolution(self.__scope_symtable[0])
+
+        # The number of occurrences of each name that was not found in any enclosing scope.
+        self.unresolved_names = Counter()  # type: Counter[str]
 
         self.__imported_symbols = {}  # type: Dict[TypeAnnotationNode, TypeAnnotationNode]
 
@@ -116,6 +190,10 @@ class AstGraphGenerator(NodeVisitor):
         # Last Lexical Use
         self.__last_lexical_use: Dict[Any, Any] = {}
 
+        # For the NEXT_USE edges: the node and symbol (if any) of each variable-like occurrence,
+        # keyed by the Attribute node or by the parent node and name of the token.
+        self.__occurrences: Dict[Any, Tuple[Any, Any]] = {}
+
     # region Constants
     INDENT = "<INDENT>"
     DEDENT = "<DEDENT>"
@@ -164,8 +242,15 @@ class AstGraphGenerator(NodeVisitor):
         self.visit(self.__ast)
         self.__add_subtoken_of_edges()
 
-        dataflow = DataflowPass(self)
-        dataflow.visit(self.__ast)
+        with timings.phase("DataflowPass"):
+            if self.__cfg_dataflow:
+                for from_node, to_node in next_use_edges(self.__ast, self.__occurrences):
+                    self._add_edge(from_node, to_node, EdgeType.NEXT_USE)
+            else:
+                dataflow = DataflowPass(
+                    self, None if self.__two_pass_dataflow else self.__occurrences
+                )
+                dataflow.visit(self.__ast)
 
         def parse_symbol_info(sinfo: SymbolInformation) -> Dict[str, Any]:
             has_annotation = any(s is not None for s in sinfo.annotatable_locations.values())
@@ -199,18 +284,30 @@ class AstGraphGenerator(NodeVisitor):
                 return False  # 'None' is deterministically computable
             return True
 
+        def is_of_interest(sinfo: Dict[str, Any]) -> bool:
+            if self.__symbol_kinds is not None and sinfo["type"] not in self.__symbol_kinds:
+                return False
+            if self.__lines_of_interest is not None:
+                return sinfo["location"][0] in self.__lines_of_interest
+            return True
+
+        supernodes = {
+            self.__node_to_id[node]: parse_symbol_info(symbol_info)
+            for node, symbol_info in self.__variable_like_symbols.items()
+            if len(symbol_info.annotatable_locations) > 0 and is_annotation_worthy(symbol_info)
+        }
+
         return {
             "nodes": [self.node_to_label(n) for n in self.__id_to_node],
             "edges": {
-                e.name: {f: list(t) for f, t in v.items() if len(t) > 0}
+                e.name: v.to_adjacency_lists()
                 for e, v in self.__edges.items()
-                if len(v) > 0
+                # Edge types that were queried (e.g. NEXT_USE in loops) are kept, even if empty.
+                if len(v) > 0 or v.is_indexed
             },
             "token-sequence": [self.__node_to_id[t] for t in self.__backbone_sequence],
             "supernodes": {
-                self.__node_to_id[node]: parse_symbol_info(symbol_info)
-                for node, symbol_info in self.__variable_like_symbols.items()
-                if len(symbol_info.annotatable_locations) > 0 and is_annotation_worthy(symbol_info)
+                node_id: sinfo for node_id, sinfo in supernodes.items() if is_of_interest(sinfo)
             },
         }
 
@@ -259,11 +356,11 @@ class AstGraphGenerator(NodeVisitor):
     ) -> None:
         from_node_idx = self.__node_id(from_node)
         to_node_idx = self.__node_id(to_node)
-        self.__edges[edge_type][from_node_idx].add(to_node_idx)
+        self.__edges[edge_type].add(from_node_idx, to_node_idx)
 
     def _get_edge_targets(self, from_node, edge_type: EdgeType) -> FrozenSet:
         from_node_idx = self.__node_id(from_node)
-        return frozenset(self._get_node(n) for n in self.__edges[edge_type][from_node_idx])
+        return frozenset(self._get_node(n) for n in self.__edges[edge_type].targets(from_node_idx))
 
     def visit(self, node: AST):
         """Visit a node adding the Child edge."""
@@ -338,6 +435,10 @@ class AstGraphGenerator(NodeVisitor):
             )
             return
         name, node, symbol, symbol_type = self.__get_symbol_for_name(name, lineno, col_offset)
+        if isinstance(node, TokenNode):
+            self.__occurrences[(self.__current_parent_node, node.token)] = node, symbol
+        else:
+            self.__occurrences[node] = node, symbol
 
         if type_annotation is not None:
             type_annotation = self.__type_graph.canonicalize_annotation(
@@ -375,16 +476,10 @@ class AstGraphGenerator(NodeVisitor):
             ):
                 name = "_" + self.__scope_symtable[-1].get_name() + name
 
-            current_idx = len(self.__scope_symtable) - 1
-            while current_idx >= 0:
-                try:
-                    symbol = self.__scope_symtable[current_idx].lookup(name)
-                    break
-                except KeyError:
-                    current_idx -= 1
-            else:
-                logging.warning(f'Symbol "{name}"@{lineno}:{col_offset} Not Found!')
-                symbol = None
+            symbol, symbol_type = self.__resolve_name(name)
+            if symbol is None:
+                self.unresolved_names[name] += 1
+            return name, node, symbol, symbol_type
         else:
             node = name
             assert isinstance(node, Attribute)
@@ -400,39 +495,53 @@ class AstGraphGenerator(NodeVisitor):
                 symbol = StrSymbol(name)
             else:
                 symbol = None
-        if isinstance(symbol, StrSymbol):
-            symbol_type = "variable"
-        elif isinstance(symbol, Symbol):
-            if symbol.is_namespace():
-                symbol_type = "class-or-function"
-            elif symbol.is_parameter():
-                symbol_type = "parameter"
-            elif symbol.is_imported():
-                symbol_type = "imported"
-            else:
-                symbol_type = "variable"
-        else:
-            symbol_type = None
+        symbol_type = "variable" if symbol is not None else None
         return name, node, symbol, symbol_type
 
+    @staticmethod
+    def __symbol_type(symbol: ScopeSymbol) -> str:
+        if symbol.is_namespace():
+            return "class-or-function"
+        elif symbol.is_parameter():
+            return "parameter"
+        elif symbol.is_imported():
+            return "imported"
+        return "variable"
+
+    def __enter_scope_resolution(self, scope: Scope) -> None:
+        if scope not in self.__scope_resolution:
+            self.__scope_resolution[scope] = {
+                s.get_name(): (s, self.__symbol_type(s)) for s in scope.get_symbols()
+            }
+
+    def __resolve_name(self, name: str) -> ResolvedName:
+        """
+        Resolve a name from the innermost to the outermost scope. Names used in a scope are
+        almost always in its own resolution map, the rare others are added to it once resolved.
+        """
+        resolution = self.__scope_resolution[self.__scope_symtable[-1]]
+        resolved = resolution.get(name)
+        if resolved is None:
+            resolved = None, None
+            for scope in reversed(self.__scope_symtable):
+                outer_resolved = self.__scope_resolution[scope].get(name)
+                if outer_resolved is not None:
+                    resolved = outer_resolved
+                    break
+            resolution[name] = resolved
+        return resolved
+
     def visit_Name(self, node: Name):
         self.__visit_variable_like(node.id, node.lineno, node.col_offset, can_annotate_here=None)
 
-    def __enter_child_symbol_table(
-        self, symtable_type: str, name: str, lineno: Optional[int] = None
-    ):
-        for child_symtable in self.__scope_symtable[-1].get_children():
-            if (
-                child_symtable.get_type() == symtable_type
-                and child_symtable.get_name() == name
-                and (lineno is None or child_symtable.get_lineno() == lineno)
-            ):
-                self.__scope_symtable.append(child_symtable)
-                break
-        else:
+    def __enter_child_symbol_table(self, symtable_type: str, name: str, lineno: int):
+        child_symtable = self.__scope_symtable[-1].get_child(symtable_type, name, lineno)
+        if child_symtable is None:
             raise ValueError(
                 f"Symbol Table for {name} of type {symtable_type} at {lineno} not found"
             )
+        self.__enter_scope_resolution(child_symtable)
+        self.__scope_symtable.append(child_symtable)
 
     # region Function Parsing
 
@@ -653,15 +762,7 @@ class AstGraphGenerator(NodeVisitor):
     # endregion
 
     def visit_Assign(self, node: Assign):
-        if (
-            hasattr(node, "value")
-            and hasattr(node.value, "func")
-            and hasattr(node.value.func, "id")
-            and node.value.func.id == "NewType"
-            and hasattr(node, "value")
-            and hasattr(node.value, "args")
-            and len(node.value.args) == 2
-        ):
+        if _is_new_type(node):
             self.__type_graph.add_type_alias(
                 parse_type_annotation_node(node.value.args[0]),
                 parse_type_annotation_node(node.value.args[1]),
@@ -1104,7 +1205,7 @@ class AstGraphGenerator(NodeVisitor):
             return node.token.replace("\n", "").replace('"', "")
         elif isinstance(node, AST):
             return node.__class__.__name__
-        elif isinstance(node, Symbol):
+        elif isinstance(node, ScopeSymbol):
             return node.get_name()
         elif isinstance(node, StrSymbol):
             return node.name
@@ -1124,7 +1225,7 @@ class AstGraphGenerator(NodeVisitor):
         for edge_type, edges in self.__edges.items():
             if draw_only_edge_types is not None and edge_type not in draw_only_edge_types:
                 continue
-            for from_idx, to_idxs in edges.items():
+            for from_idx, to_idxs in edges.to_adjacency_lists().items():
                 nodes_to_be_drawn.add(from_idx)
                 for to_idx in to_idxs:
                     nodes_to_be_drawn.add(to_idx)
@@ -1149,7 +1250,7 @@ class AstGraphGenerator(NodeVisitor):
             for edge_type, edges in self.__edges.items():
                 if draw_only_edge_types is not None and edge_type not in draw_only_edge_types:
                     continue
-                for from_idx, to_idxs in edges.items():
+                for from_idx, to_idxs in edges.to_adjacency_lists().items():
                     for to_idx in to_idxs:
                         f.write(f'\tnode{from_idx} -> node{to_idx} [label="{edge_type.name}"];\n')
             f.write("}\n")  # graph
@@ -1,6 +1,7 @@
 import typing
+from array import array
 from enum import Enum, auto
-from typing import Optional, NamedTuple, List, Dict
+from typing import Optional, NamedTuple, List, Dict, Iterable
 
 from .typeparsing import TypeAnnotationNode
 
@@ -16,6 +17,61 @@ class EdgeType(Enum):
     SUBTOKEN_OF = auto()
 
 
+class EdgeStore:
+    """
+    The edges of a single type, stored compactly as two growable arrays of node ids.
+
+    Duplicate edges are only removed when serializing. The targets of each node are indexed
+    lazily, the first time that they are queried, and from then on duplicates are not stored.
+    """
+
+    def __init__(self):
+        self.__sources = array("l")
+        self.__targets = array("l")
+        # The distinct targets of each node, as the keys of an insertion-ordered dict.
+        self.__targets_of: Optional[Dict[int, Dict[int, None]]] = None
+
+    def __len__(self) -> int:
+        return len(self.__sources)
+
+    @property
+    def is_indexed(self) -> bool:
+        return self.__targets_of is not None
+
+    def add(self, from_node_idx: int, to_node_idx: int) -> None:
+        if self.__targets_of is not None:
+            targets = self.__targets_of.setdefault(from_node_idx, {})
+            if to_node_idx in targets:
+                return
+            targets[to_node_idx] = None
+        self.__sources.append(from_node_idx)
+        self.__targets.append(to_node_idx)
+
+    def targets(self, from_node_idx: int) -> Iterable[int]:
+        if self.__targets_of is None:
+            self.__targets_of = {}
+            for from_idx, to_idx in zip(self.__sources, self.__targets):
+                self.__targets_of.setdefault(from_idx, {})[to_idx] = None
+        return self.__targets_of.get(from_node_idx, {}).keys()
+
+    def to_adjacency_lists(self) -> Dict[int, List[int]]:
+        """The deduplicated targets of each source node, in the order they were first added."""
+        adjacency_lists: Dict[int, List[int]] = {}
+        seen = set()
+        num_ids = max(max(self.__sources, default=0), max(self.__targets, default=0)) + 1
+        for from_idx, to_idx in zip(self.__sources, self.__targets):
+            edge_id = from_idx * num_ids + to_idx
+            if edge_id in seen:
+                continue
+            seen.add(edge_id)
+            targets = adjacency_lists.get(from_idx)
+            if targets is None:
+                adjacency_lists[from_idx] = [to_idx]
+            else:
+                targets.append(to_idx)
+        return adjacency_lists
+
+
 class TokenNode:
     """A wrapper around token nodes, such that an object-identity is used for comparing nodes."""
 
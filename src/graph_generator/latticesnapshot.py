@@ -0,0 +1,135 @@
+"""
+Compile the typing rules into a snapshot of the base type lattice, which TypeLatticeGenerator
+loads instead of parsing the rules again.
+
+The snapshot is saved next to the rules, with the .lattice.pkl extension. It is ignored once
+the rules change.
+
+Usage:
+    latticesnapshot.py [options] TYPING_RULES
+
+Options:
+    -h --help                  Show this screen.
+
+Run with `PYTHONPATH=src python -m graph_generator.latticesnapshot src/metadata/typingRules.json`.
+"""
+import hashlib
+import os
+import pickle
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from docopt import docopt
+
+from .typeparsing import AliasResolver, TypeAnnotationNode
+
+# Bump when the format of the snapshots or the annotation node classes change.
+LATTICE_SNAPSHOT_VERSION = 3
+
+
+def rules_digest(typing_rules: bytes) -> str:
+    return hashlib.sha256(typing_rules).hexdigest()
+
+
+def snapshot_path(typing_rules_path: str) -> str:
+    return os.path.splitext(typing_rules_path)[0] + ".lattice.pkl"
+
+
+class BaseLattice:
+    """
+    The types, aliases and is-a edges of the typing rules, before any project type is added.
+    It is shared by the TypeLatticeGenerators of a process, so it is never modified.
+    """
+
+    def __init__(
+        self,
+        digest: str,
+        nodes: List[TypeAnnotationNode],
+        aliases: Dict[TypeAnnotationNode, TypeAnnotationNode],
+        is_a_edges: Dict[int, Tuple[int, ...]],
+        ancestors: List[int],
+        non_generic_types: FrozenSet[TypeAnnotationNode],
+    ):
+        self.digest = digest
+        self.nodes = tuple(nodes)
+        self.aliases = aliases
+        self.alias_resolver = AliasResolver(aliases)
+        self.is_a_edges = is_a_edges
+        # The types reachable from each type through the is-a edges, as bitsets over the node ids.
+        self.ancestors = tuple(ancestors)
+        self.non_generic_types = non_generic_types
+
+        self.node_ids = {node: i for i, node in enumerate(self.nodes)}
+        self.repr_ids = {repr(node): i for i, node in enumerate(self.nodes)}
+
+    def save(self, path: str) -> None:
+        """Save the nodes once, and refer to them by their ids everywhere else."""
+        node_ids = self.node_ids
+        snapshot = (
+            LATTICE_SNAPSHOT_VERSION,
+            self.digest,
+            self.nodes,
+            [(node_ids[alias], node_ids[name]) for alias, name in self.aliases.items()],
+            list(self.is_a_edges.items()),
+            self.ancestors,
+            [node_ids[node] for node in self.non_generic_types],
+        )
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path: str, digest: str) -> Optional["BaseLattice"]:
+        """The snapshot at the path, or None if it is missing, of another version or stale."""
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring the unreadable type lattice snapshot {path}: {e}")
+            return None
+
+        if not isinstance(snapshot, tuple) or snapshot[:2] != (LATTICE_SNAPSHOT_VERSION, digest):
+            return None
+        _, _, nodes, aliases, is_a_edges, ancestors, non_generic_types = snapshot
+        return BaseLattice(
+            digest,
+            nodes,
+            {nodes[alias]: nodes[name] for alias, name in aliases},
+            dict(is_a_edges),
+            ancestors,
+            frozenset(nodes[i] for i in non_generic_types),
+        )
+
+
+_loaded_lattices = {}  # type: Dict[Tuple[str, str], BaseLattice]
+
+
+def load_base_lattice(typing_rules_path: str, digest: str) -> Optional[BaseLattice]:
+    """The base lattice of the rules, from this process or from their snapshot, if up to date."""
+    key = os.path.abspath(typing_rules_path), digest
+    base_lattice = _loaded_lattices.get(key)
+    if base_lattice is None:
+        base_lattice = BaseLattice.load(snapshot_path(typing_rules_path), digest)
+        if base_lattice is not None:
+            _loaded_lattices[key] = base_lattice
+    return base_lattice
+
+
+def remember_base_lattice(typing_rules_path: str, base_lattice: BaseLattice) -> None:
+    _loaded_lattices[os.path.abspath(typing_rules_path), base_lattice.digest] = base_lattice
+
+
+def run(arguments) -> None:
+    from .type_lattice_generator import TypeLatticeGenerator
+
+    typing_rules_path = arguments["TYPING_RULES"]
+    output_path = snapshot_path(typing_rules_path)
+    base_lattice = TypeLatticeGenerator(typing_rules_path, use_snapshot=False).base_lattice
+    base_lattice.save(output_path)
+    print(f"Saved the {len(base_lattice.nodes)} types of {typing_rules_path} to {output_path}")
+
+
+if __name__ == "__main__":
+    run(docopt(__doc__))
@@ -0,0 +1,123 @@
+import resource
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+
+class PhaseStats:
+    def __init__(self):
+        self.count = 0  # type: int
+        self.wall_time = 0.0  # type: float
+        self.cpu_time = 0.0  # type: float
+        self.peak_rss_kb = 0  # type: int
+
+    def merge(self, other: "PhaseStats") -> None:
+        self.count += other.count
+        self.wall_time += other.wall_time
+        self.cpu_time += other.cpu_time
+        self.peak_rss_kb = max(self.peak_rss_kb, other.peak_rss_kb)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "wall_time_s": self.wall_time,
+            "cpu_time_s": self.cpu_time,
+            "peak_rss_mb": self.peak_rss_kb / 1024,
+        }
+
+
+class PhaseTimings:
+    """
+    Accumulates the wall time, CPU time and peak RSS of named phases, e.g. across all files.
+
+    Phases can be nested, and the time of a phase excludes the time of the phases nested in it.
+    The peak RSS is the peak of the process so far, as observed at the end of the phase.
+    """
+
+    def __init__(self):
+        self.phases = {}  # type: Dict[str, PhaseStats]
+        self.__start_wall_time = time.perf_counter()
+        self.__start_cpu_time = time.process_time()
+        self.__nested_times = []  # type: List[List[float]]
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        nested_time = [0.0, 0.0]  # The wall and CPU time of the phases nested in this one.
+        self.__nested_times.append(nested_time)
+        start_wall_time, start_cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_wall_time
+            cpu_time = time.process_time() - start_cpu_time
+            self.__nested_times.pop()
+            if len(self.__nested_times) > 0:
+                self.__nested_times[-1][0] += wall_time
+                self.__nested_times[-1][1] += cpu_time
+
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = PhaseStats()
+            stats.count += 1
+            stats.wall_time += wall_time - nested_time[0]
+            stats.cpu_time += cpu_time - nested_time[1]
+            stats.peak_rss_kb = max(
+                stats.peak_rss_kb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            )
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yield the elements of the iterable, timing the computation of each one as a phase."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    return
+            yield element
+
+    def merge(self, phases: Dict[str, PhaseStats]) -> None:
+        """Add the phases timed by another process, e.g. a worker extracting graphs."""
+        for name, other_stats in phases.items():
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = PhaseStats()
+            stats.merge(other_stats)
+
+    def to_json(self) -> Dict[str, Any]:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "phases": {name: stats.to_json() for name, stats in self.phases.items()},
+            "total": {
+                "wall_time_s": time.perf_counter() - self.__start_wall_time,
+                "cpu_time_s": time.process_time() - self.__start_cpu_time,
+                "children_cpu_time_s": children_usage.ru_utime + children_usage.ru_stime,
+                "peak_rss_mb": usage.ru_maxrss / 1024,
+                "children_peak_rss_mb": children_usage.ru_maxrss / 1024,
+            },
+        }
+
+    def to_markdown(self) -> str:
+        report = self.to_json()
+        lines = [
+            "| Phase | Count | Wall time (s) | CPU time (s) | Peak RSS (MB) |",
+            "| -- | --: | --: | --: | --: |",
+        ]
+        for name, stats in report["phases"].items():
+            lines.append(
+                f"| {name} | {stats['count']} | {stats['wall_time_s']:.2f} | "
+                f"{stats['cpu_time_s']:.2f} | {stats['peak_rss_mb']:.0f} |"
+            )
+        total = report["total"]
+        lines.append(
+            f"| **Total** | | {total['wall_time_s']:.2f} | {total['cpu_time_s']:.2f} | "
+            f"{total['peak_rss_mb']:.0f} |"
+        )
+        return "\n".join(lines) + "\n"
+
+
+# The timings of the current process.
+timings = PhaseTimings()
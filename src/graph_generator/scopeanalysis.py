@@ -0,0 +1,354 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+from typed_ast.ast3 import (
+    AST,
+    AnnAssign,
+    AsyncFunctionDef,
+    ClassDef,
+    DictComp,
+    ExceptHandler,
+    FunctionDef,
+    GeneratorExp,
+    Global,
+    Lambda,
+    ListComp,
+    Load,
+    Module,
+    Name,
+    Nonlocal,
+    NodeVisitor,
+    SetComp,
+    Try,
+    alias,
+    arguments,
+)
+
+__all__ = ["Scope", "ScopeSymbol", "analyze_scopes"]
+
+# The symbol flags, as in CPython's symtable.
+DEF_GLOBAL = 1
+DEF_LOCAL = 2
+DEF_PARAM = 4
+DEF_NONLOCAL = 8
+USE = 16
+DEF_FREE = 32
+DEF_IMPORT = 128
+DEF_ANNOT = 256
+DEF_BOUND = DEF_LOCAL | DEF_PARAM | DEF_IMPORT
+
+
+class ScopeSymbol:
+    """A name of a scope. Mirrors symtable.Symbol; there is a single object per scope and name."""
+
+    __slots__ = ("__name", "_flags", "__scope")
+
+    def __init__(self, name: str, scope: "Scope"):
+        self.__name = name
+        self._flags = 0
+        self.__scope = scope
+
+    def __repr__(self) -> str:
+        return f"<ScopeSymbol {self.__name}>"
+
+    def get_name(self) -> str:
+        return self.__name
+
+    def is_parameter(self) -> bool:
+        return bool(self._flags & DEF_PARAM)
+
+    def is_imported(self) -> bool:
+        return bool(self._flags & DEF_IMPORT)
+
+    def is_declared_global(self) -> bool:
+        return bool(self._flags & DEF_GLOBAL)
+
+    def is_nonlocal(self) -> bool:
+        return bool(self._flags & DEF_NONLOCAL)
+
+    def is_assigned(self) -> bool:
+        return bool(self._flags & DEF_LOCAL)
+
+    def is_referenced(self) -> bool:
+        return bool(self._flags & USE)
+
+    def is_free(self) -> bool:
+        return bool(self._flags & DEF_FREE)
+
+    def is_namespace(self) -> bool:
+        """True if the name is also bound to a class or function scope, as in symtable."""
+        return self.__name in self.__scope._child_names
+
+
+class Scope:
+    """A module, class or function scope. Mirrors symtable.SymbolTable."""
+
+    def __init__(self, scope_type: str, name: str, lineno: int):
+        self.__type = scope_type
+        self.__name = name
+        self.__lineno = lineno
+        self._symbols: Dict[str, ScopeSymbol] = {}
+        self._children: List["Scope"] = []
+        self._child_names: Set[str] = set()
+        self.__child_index: Optional[Dict[Tuple[str, str, int], "Scope"]] = None
+
+    def __repr__(self) -> str:
+        return f"<Scope {self.__type} {self.__name}@{self.__lineno}>"
+
+    def get_type(self) -> str:
+        return self.__type
+
+    def get_name(self) -> str:
+        return self.__name
+
+    def get_lineno(self) -> int:
+        return self.__lineno
+
+    def get_children(self) -> List["Scope"]:
+        return self._children
+
+    def get_child(self, scope_type: str, name: str, lineno: int) -> Optional["Scope"]:
+        """The first child scope with this type, name and line, or None."""
+        if self.__child_index is None:
+            self.__child_index = {}
+            for child in self._children:
+                key = child.get_type(), child.get_name(), child.get_lineno()
+                self.__child_index.setdefault(key, child)
+        return self.__child_index.get((scope_type, name, lineno))
+
+    def get_identifiers(self) -> List[str]:
+        return list(self._symbols)
+
+    def get_symbols(self) -> List[ScopeSymbol]:
+        return list(self._symbols.values())
+
+    def lookup(self, name: str) -> ScopeSymbol:
+        """Raises a KeyError if the name is not in this scope."""
+        return self._symbols[name]
+
+    def _add(self, name: str, flags: int) -> None:
+        symbol = self._symbols.get(name)
+        if symbol is None:
+            symbol = self._symbols[name] = ScopeSymbol(name, self)
+        symbol._flags |= flags
+
+
+def _mangle(private: Optional[str], name: str) -> str:
+    """Mangle a private name of a class, as in CPython's _Py_Mangle."""
+    if private is None or not name.startswith("__") or name.endswith("__") or "." in name:
+        return name
+    private = private.lstrip("_")
+    if len(private) == 0:
+        return name
+    return "_" + private + name
+
+
+class _ScopeVisitor(NodeVisitor):
+    """
+    Collects the names of each scope in the same order as CPython's symtable, so that scopes
+    (e.g. two lambdas on the same line) are found in the same order.
+    """
+
+    def __init__(self, module: Module):
+        self.module_scope = Scope("module", "top", 0)
+        self.__current = self.module_scope
+        self.__private: Optional[str] = None
+        self.visit(module)
+
+    def __add_def(self, name: str, flags: int) -> None:
+        name = _mangle(self.__private, name)
+        self.__current._add(name, flags)
+        if flags & DEF_GLOBAL:
+            self.module_scope._add(name, flags)
+
+    def __visit_all(self, nodes) -> None:
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def __enter_scope(self, scope_type: str, name: str, lineno: int) -> Scope:
+        scope = Scope(scope_type, name, lineno)
+        self.__current._children.append(scope)
+        self.__current._child_names.add(name)
+        outer_scope, self.__current = self.__current, scope
+        return outer_scope
+
+    def __visit_function(self, node, name: str, body: List[AST]) -> None:
+        args: arguments = node.args
+        self.__visit_all(args.defaults)
+        self.__visit_all(args.kw_defaults)
+        if not isinstance(node, Lambda):
+            for argument in args.args:
+                self.__visit_all([argument.annotation])
+            for argument in (args.vararg, args.kwarg):
+                if argument is not None:
+                    self.__visit_all([argument.annotation])
+            for argument in args.kwonlyargs:
+                self.__visit_all([argument.annotation])
+            self.__visit_all([node.returns])
+            self.__visit_all(node.decorator_list)
+
+        outer_scope = self.__enter_scope("function", name, node.lineno)
+        for argument in args.args + args.kwonlyargs:
+            self.__add_def(argument.arg, DEF_PARAM)
+        for argument in (args.vararg, args.kwarg):
+            if argument is not None:
+                self.__add_def(argument.arg, DEF_PARAM)
+        self.__visit_all(body)
+        self.__current = outer_scope
+
+    def visit_FunctionDef(self, node: FunctionDef) -> None:
+        self.__add_def(node.name, DEF_LOCAL)
+        self.__visit_function(node, node.name, node.body)
+
+    def visit_AsyncFunctionDef(self, node: AsyncFunctionDef) -> None:
+        self.__add_def(node.name, DEF_LOCAL)
+        self.__visit_function(node, node.name, node.body)
+
+    def visit_Lambda(self, node: Lambda) -> None:
+        self.__visit_function(node, "lambda", [node.body])
+
+    def visit_ClassDef(self, node: ClassDef) -> None:
+        self.__add_def(node.name, DEF_LOCAL)
+        self.__visit_all(node.bases)
+        self.__visit_all(node.keywords)
+        self.__visit_all(node.decorator_list)
+        outer_scope = self.__enter_scope("class", node.name, node.lineno)
+        outer_private, self.__private = self.__private, node.name
+        self.__visit_all(node.body)
+        self.__private = outer_private
+        self.__current = outer_scope
+
+    def __visit_comprehension(self, node, name: str, elements: List[AST]) -> None:
+        outermost = node.generators[0]
+        # The outermost iterator is evaluated in the enclosing scope and passed as the ".0" argument.
+        self.visit(outermost.iter)
+        outer_scope = self.__enter_scope("function", name, node.lineno)
+        self.__current._add(".0", DEF_PARAM)
+        self.visit(outermost.target)
+        self.__visit_all(outermost.ifs)
+        for generator in node.generators[1:]:
+            self.visit(generator)
+        self.__visit_all(elements)
+        self.__current = outer_scope
+
+    def visit_ListComp(self, node: ListComp) -> None:
+        self.__visit_comprehension(node, "listcomp", [node.elt])
+
+    def visit_SetComp(self, node: SetComp) -> None:
+        self.__visit_comprehension(node, "setcomp", [node.elt])
+
+    def visit_GeneratorExp(self, node: GeneratorExp) -> None:
+        self.__visit_comprehension(node, "genexpr", [node.elt])
+
+    def visit_DictComp(self, node: DictComp) -> None:
+        self.__visit_comprehension(node, "dictcomp", [node.value, node.key])
+
+    def visit_Name(self, node: Name) -> None:
+        if isinstance(node.ctx, Load):
+            self.__add_def(node.id, USE)
+            if node.id == "super" and self.__current.get_type() == "function":
+                self.__add_def("__class__", USE)
+        else:
+            self.__add_def(node.id, DEF_LOCAL)
+
+    def visit_Global(self, node: Global) -> None:
+        for name in node.names:
+            self.__add_def(name, DEF_GLOBAL)
+
+    def visit_Nonlocal(self, node: Nonlocal) -> None:
+        for name in node.names:
+            self.__add_def(name, DEF_NONLOCAL)
+
+    def visit_alias(self, node: alias) -> None:
+        if node.name == "*":
+            return
+        name = node.asname if node.asname is not None else node.name.split(".")[0]
+        self.__add_def(name, DEF_IMPORT)
+
+    def visit_ExceptHandler(self, node: ExceptHandler) -> None:
+        self.__visit_all([node.type])
+        if node.name is not None:
+            self.__add_def(node.name, DEF_LOCAL)
+        self.__visit_all(node.body)
+
+    def visit_AnnAssign(self, node: AnnAssign) -> None:
+        if isinstance(node.target, Name):
+            if node.simple:
+                self.__add_def(node.target.id, DEF_ANNOT | DEF_LOCAL)
+            elif node.value is not None:
+                self.__add_def(node.target.id, DEF_LOCAL)
+        else:
+            self.visit(node.target)
+        self.visit(node.annotation)
+        self.__visit_all([node.value])
+
+    def visit_Try(self, node: Try) -> None:
+        self.__visit_all(node.body)
+        self.__visit_all(node.orelse)
+        self.__visit_all(node.handlers)
+        self.__visit_all(node.finalbody)
+
+
+def _analyze_block(scope: Scope, bound: Optional[Set[str]], free: Set[str], global_: Set[str]):
+    """
+    Propagate the free variables of nested functions to the enclosing scopes, as in CPython's
+    analyze_block. The scopes between a free variable and its binding also get a symbol for it.
+    """
+    local = set()
+    new_global, new_bound = set(), set()
+    if scope.get_type() == "class":
+        new_global |= global_
+        if bound is not None:
+            new_bound |= bound
+
+    for name, symbol in scope._symbols.items():
+        flags = symbol._flags
+        if flags & DEF_GLOBAL:
+            global_.add(name)
+            if bound is not None:
+                bound.discard(name)
+        elif flags & DEF_NONLOCAL:
+            free.add(name)
+        elif flags & DEF_BOUND:
+            local.add(name)
+            global_.discard(name)
+        elif bound is not None and name in bound:
+            free.add(name)
+
+    if scope.get_type() != "class":
+        if scope.get_type() == "function":
+            new_bound |= local
+        if bound is not None:
+            new_bound |= bound
+        new_global |= global_
+    else:
+        new_bound.add("__class__")
+
+    children_free: Set[str] = set()
+    for child in scope.get_children():
+        child_free: Set[str] = set()
+        _analyze_block(child, set(new_bound), child_free, set(new_global))
+        children_free |= child_free
+
+    if scope.get_type() == "function":
+        children_free -= local  # These become cell variables.
+    elif scope.get_type() == "class":
+        children_free.discard("__class__")
+
+    for name in children_free:
+        if name in scope._symbols:
+            continue
+        if bound is not None and name not in bound:
+            continue  # A global
+        scope._add(name, DEF_FREE)
+    free |= children_free
+
+
+def analyze_scopes(module: Module) -> Scope:
+    """
+    Compute the scopes of a module from its typed AST, as CPython's symtable does from the
+    source, and return the module scope.
+    """
+    module_scope = _ScopeVisitor(module).module_scope
+    _analyze_block(module_scope, None, set(), set())
+    return module_scope
@@ -1,9 +1,10 @@
 from typing import Any, List, Dict, FrozenSet, Set, Tuple, Optional
-from collections import defaultdict, ChainMap
+from collections import defaultdict
 from itertools import chain
 from functools import lru_cache
 import json
 
+from .latticesnapshot import BaseLattice, load_base_lattice, remember_base_lattice, rules_digest
 from .typeparsing import (
     TypeAnnotationNode,
     NameAnnotationNode,
@@ -13,7 +14,7 @@ from .typeparsing import RewriteRuleVisitor
 from .typeparsing import DirectInheritanceRewriting
 from .typeparsing import EraseOnceTypeRemoval
 from .typeparsing import PruneAnnotationVisitor
-from .typeparsing import AliasReplacementVisitor
+from .typeparsing import AliasReplacementVisitor, AliasResolver
 from .typeparsing.rewriterules import RemoveStandAlones
 from .typeparsing.rewriterules import RemoveRecursiveGenerics
 from .typeparsing.rewriterules import RemoveUnionWithAnys
@@ -24,18 +25,76 @@ class TypeLatticeGenerator:
 
     ANY_TYPE = parse_type_annotation_node("typing.Any")
 
-    def __init__(self, typing_rules_path: str, max_depth_size: int = 2, max_list_size: int = 2):
+    def __init__(
+        self,
+        typing_rules_path: str,
+        max_depth_size: int = 2,
+        max_list_size: int = 2,
+        use_snapshot: bool = True,
+    ):
+        """
+        The types of the typing rules are loaded from their snapshot (see latticesnapshot.py) if
+        it is up to date, and are otherwise compiled from the rules. Either way, they are shared
+        with the other generators of the process: the types of the project are added on top of
+        copies of the tables of this base lattice.
+        """
         self.__to_process = []
         self.__processed = set()
         self.new_type_rules = defaultdict(set)  # [new type, ref]
         self.module_naming_rules = {}  # [short, long.version]
+
+        self.__max_annotation_depth = max_depth_size
+        self.__max_depth_pruning_visitor = PruneAnnotationVisitor(self.ANY_TYPE, max_list_size)
+
+        self.project_is_a = defaultdict(set)  # type: Dict[int, Set[int]]
+
+        with open(typing_rules_path, "rb") as f:
+            typing_rules = f.read()
+        digest = rules_digest(typing_rules)
+        base_lattice = load_base_lattice(typing_rules_path, digest) if use_snapshot else None
+        if base_lattice is None:
+            base_lattice = self.__compile_rules(json.loads(typing_rules), digest)
+            remember_base_lattice(typing_rules_path, base_lattice)
+        self.base_lattice = base_lattice
+
+        self.__aliases = base_lattice.aliases  # alias -> default name
+        self.__project_specific_aliases = AliasResolver(parent=base_lattice.alias_resolver)
+        self.__all_types = dict(base_lattice.node_ids)
+        self.__ids_to_nodes = list(base_lattice.nodes)
+        self.__type_reprs = dict(base_lattice.repr_ids)
+        # [specialized type, general type]
+        self.is_a_edges = defaultdict(set)  # type: Dict[int, Set[int]]
+        self.__subtypes = defaultdict(set)  # type: Dict[int, Set[int]]
+        for type_id, parent_ids in base_lattice.is_a_edges.items():
+            self.is_a_edges[type_id] = set(parent_ids)
+            for parent_id in parent_ids:
+                self.__subtypes[parent_id].add(type_id)
+        self.__ancestors = list(base_lattice.ancestors)
+        self.__non_generic_types = base_lattice.non_generic_types
+
+        self.__type_erasure = EraseOnceTypeRemoval()
+        self.__direct_inheritance_rewriting = DirectInheritanceRewriting(
+            self.__is_a_relationships, self.__non_generic_types
+        )
+
+        self.__rewrites_verbose_annotations = RewriteRuleVisitor(
+            [
+                RemoveUnionWithAnys(),
+                RemoveStandAlones(),
+                RemoveRecursiveGenerics(),
+                RemoveGenericWithAnys(),
+            ]
+        )
+        assert len(self.__ids_to_nodes) == len(set(repr(r) for r in self.__ids_to_nodes))
+
+    def __compile_rules(self, rules: Dict[str, Any], digest: str) -> BaseLattice:
         self.__all_types = {self.ANY_TYPE: 0}
         self.__ids_to_nodes = [self.ANY_TYPE]
         self.__type_reprs = {repr(self.ANY_TYPE): 0}
+        self.__subtypes = defaultdict(set)
+        self.__ancestors = [1]
 
         # Rewrites
-        with open(typing_rules_path, "r") as f:
-            rules = json.load(f)
         # alias -> default name
         self.__aliases = {
             parse_type_annotation_node(k): parse_type_annotation_node(v)
@@ -43,14 +102,9 @@ class TypeLatticeGenerator:
         }
         for type_annotation in chain(self.__aliases.keys(), self.__aliases.values()):
             self.__annotation_to_id(type_annotation)
-        self.__project_specific_aliases = {}
-
-        self.__max_annotation_depth = max_depth_size
-        self.__max_depth_pruning_visitor = PruneAnnotationVisitor(self.ANY_TYPE, max_list_size)
 
         # [specialized type, general type]
         self.is_a_edges = defaultdict(set)  # type: Dict[int, Set[int]]
-        self.project_is_a = defaultdict(set)  # type: Dict[int, Set[int]]
 
         # type -> supertypes
         for k, v in rules["is_a_relations"]:
@@ -61,53 +115,34 @@ class TypeLatticeGenerator:
         for known_type in self.__all_types:
             known_type_id = self.__annotation_to_id(known_type)
             if known_type != self.ANY_TYPE and len(self.is_a_edges[known_type_id]) == 0:
-                self.is_a_edges[known_type_id].add(0)
+                self.__add_is_a_edge(known_type_id, 0)
 
         self.__compute_non_generic_types()
-
-        self.__type_erasure = EraseOnceTypeRemoval()
-        self.__direct_inheritance_rewriting = DirectInheritanceRewriting(
-            self.__is_a_relationships, self.__non_generic_types
-        )
-
-        self.__rewrites_verbose_annotations = RewriteRuleVisitor(
-            [
-                RemoveUnionWithAnys(),
-                RemoveStandAlones(),
-                RemoveRecursiveGenerics(),
-                RemoveGenericWithAnys(),
-            ]
+        return BaseLattice(
+            digest,
+            self.__ids_to_nodes,
+            self.__aliases,
+            {type_id: tuple(parent_ids) for type_id, parent_ids in self.is_a_edges.items()},
+            self.__ancestors,
+            self.__non_generic_types,
         )
-        assert len(self.__ids_to_nodes) == len(set(repr(r) for r in self.__ids_to_nodes))
 
     def create_alias_replacement(
         self, imported_symbols: Dict[TypeAnnotationNode, TypeAnnotationNode]
     ) -> AliasReplacementVisitor:
-        return AliasReplacementVisitor(
-            ChainMap(imported_symbols, self.__project_specific_aliases, self.__aliases)
-        )
+        return AliasReplacementVisitor(self.__project_specific_aliases.overlay(imported_symbols))
 
     def __compute_non_generic_types(self):
         # Now get all the annotations that are *not* generics
-        child_edges = defaultdict(set)
-        for parent, children in self.is_a_edges.items():
-            for child in children:
-                child_edges[child].add(parent)
-
-        generic_transitive_closure = set()
-        to_visit = [
-            self.__all_types[parse_type_annotation_node("typing.Generic")],
-            self.__all_types[parse_type_annotation_node("typing.Tuple")],
-            self.__all_types[parse_type_annotation_node("typing.Callable")],
-        ]
-        while len(to_visit) > 0:
-            next_node = to_visit.pop()
-            generic_transitive_closure.add(next_node)
-            to_visit.extend(
-                (t for t in child_edges[next_node] if t not in generic_transitive_closure)
-            )
-
-        non_generic_types = set(self.__all_types.values()) - generic_transitive_closure
+        generic_types = 0
+        for generic_type in ("typing.Generic", "typing.Tuple", "typing.Callable"):
+            generic_types |= 1 << self.__all_types[parse_type_annotation_node(generic_type)]
+
+        non_generic_types = {
+            type_idx
+            for type_idx in self.__all_types.values()
+            if self.__ancestors[type_idx] & generic_types == 0
+        }
 
         # Add special objects
         non_generic_types.add(self.__annotation_to_id(parse_type_annotation_node("abc.ABC")))
@@ -123,23 +158,28 @@ class TypeLatticeGenerator:
             self.__all_types[annotation] = annotation_idx
             self.__type_reprs[repr(annotation)] = annotation_idx
             self.__ids_to_nodes.append(annotation)
+            self.__ancestors.append(1 << annotation_idx)
 
         return annotation_idx
 
-    def __all_reachable_from(self, type_idx: int) -> FrozenSet[int]:
-        reachable = set()
-        to_visit = [type_idx]  # type: List[int]
+    def __add_is_a_edge(self, from_node_idx: int, to_node_idx: int) -> None:
+        """
+        Add the edge and update the transitive closure: the types reachable from each type, itself
+        included, as a bitset over the type ids. from_node and its subtypes now reach the ancestors
+        of to_node. The subtypes of a type that already reaches them are skipped, since they reach
+        them through it.
+        """
+        self.is_a_edges[from_node_idx].add(to_node_idx)
+        self.__subtypes[to_node_idx].add(from_node_idx)
+        new_ancestors = self.__ancestors[to_node_idx]
+        to_visit = [from_node_idx]
         while len(to_visit) > 0:
-            next_type_idx = to_visit.pop()
-            reachable.add(next_type_idx)
-            to_visit.extend(
-                (
-                    parent_type_idx
-                    for parent_type_idx in self.is_a_edges[next_type_idx]
-                    if parent_type_idx not in reachable
-                )
-            )
-        return frozenset(reachable)
+            type_idx = to_visit.pop()
+            ancestors = self.__ancestors[type_idx]
+            if ancestors | new_ancestors == ancestors:
+                continue
+            self.__ancestors[type_idx] = ancestors | new_ancestors
+            to_visit.extend(self.__subtypes[type_idx])
 
     def __add_is_a_relationship(
         self, from_type: TypeAnnotationNode, to_type: TypeAnnotationNode
@@ -150,17 +190,15 @@ class TypeLatticeGenerator:
         if from_node_idx == to_node_idx:
             return
 
-        reachable_from_idx = self.__all_reachable_from(from_node_idx)
-        if to_node_idx in reachable_from_idx:
+        if self.__ancestors[from_node_idx] & (1 << to_node_idx):
             # This is already reachable, ignore direct is-a relationship.
             return
 
-        all_reachable = self.__all_reachable_from(to_node_idx)
-        if from_node_idx in all_reachable:
+        if self.__ancestors[to_node_idx] & (1 << from_node_idx):
             print(f"The {from_node_idx}<->{to_node_idx} would be a circle. Ignoring.")
             return
 
-        self.is_a_edges[from_node_idx].add(to_node_idx)
+        self.__add_is_a_edge(from_node_idx, to_node_idx)
 
     def __is_a_relationships(self, from_type: TypeAnnotationNode) -> FrozenSet[TypeAnnotationNode]:
         from_node_idx = self.__annotation_to_id(from_type)
@@ -177,7 +215,7 @@ class TypeLatticeGenerator:
         pruned = annotation.accept_visitor(
             self.__max_depth_pruning_visitor, self.__max_annotation_depth
         )
-        if pruned != annotation:
+        if pruned is not annotation:
             self.__add_is_a_relationship(annotation, pruned)
             self.__to_process.append(pruned)
         else:
@@ -193,10 +231,26 @@ class TypeLatticeGenerator:
     def __rewrite_verbose(self, type_annotation: TypeAnnotationNode) -> TypeAnnotationNode:
         return type_annotation.accept_visitor(self.__rewrites_verbose_annotations, None)
 
+    def budget_counters(self) -> Dict[str, int]:
+        """
+        How many types had more combinations of supertypes or erasures of their elements than
+        the budget during the last build_graph, and how many combinations were left out.
+        """
+        counters = {}
+        for name, budget in (
+            ("inheritance_rewriting", self.__direct_inheritance_rewriting.budget),
+            ("erasure", self.__type_erasure.budget),
+        ):
+            counters[f"{name}_over_budget"] = budget.num_exceeded
+            counters[f"{name}_dropped_combinations"] = budget.num_dropped
+        return counters
+
     def build_graph(self):
         print(
             "Building type graph for project... (%s elements to process)" % len(self.__to_process)
         )
+        self.__direct_inheritance_rewriting.budget.reset()
+        self.__type_erasure.budget.reset()
         i = 0
 
         while len(self.__to_process) > 0:
@@ -254,6 +308,9 @@ class TypeLatticeGenerator:
 
         # Clean up project-specific aliases
         self.__project_specific_aliases.clear()
+        over_budget = {name: count for name, count in self.budget_counters().items() if count > 0}
+        if len(over_budget) > 0:
+            print(f"Sampled the combinations of the types over budget: {over_budget}")
         print("Done building type graph")
 
     def add_class(self, class_name: str, parents: List[TypeAnnotationNode]) -> None:
@@ -267,7 +324,11 @@ class TypeLatticeGenerator:
     def add_type_alias(
         self, new_annotation: TypeAnnotationNode, ref_annotation: TypeAnnotationNode
     ) -> None:
-        self.__project_specific_aliases[new_annotation] = ref_annotation
+        self.__project_specific_aliases.add(new_annotation, ref_annotation)
+
+    def clear_type_aliases(self) -> None:
+        """Forget the project-specific type aliases, as build_graph does once done."""
+        self.__project_specific_aliases.clear()
 
     def canonicalize_annotation(
         self,
@@ -1,7 +1,8 @@
 from .visitor import TypeAnnotationVisitor
 from .nodes import *
 
-from .aliasreplacement import AliasReplacementVisitor
+from .aliasreplacement import AliasResolver, AliasReplacementVisitor
+from .combinations import CombinationBudget
 from .erasure import EraseOnceTypeRemoval
 from .inheritancerewrite import DirectInheritanceRewriting
 from .pruneannotations import PruneAnnotationVisitor
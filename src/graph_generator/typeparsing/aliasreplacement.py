@@ -1,4 +1,4 @@
-from typing import Dict, Tuple
+from typing import Any, Dict, Optional, Set, Tuple, Union
 
 from .nodes import (
     TypeAnnotationNode,
@@ -11,42 +11,157 @@ from .nodes import (
 )
 from .visitor import TypeAnnotationVisitor
 
-__all__ = ["AliasReplacementVisitor"]
+__all__ = ["AliasResolver", "AliasReplacementVisitor"]
 
 
-class AliasReplacementVisitor(TypeAnnotationVisitor):
-    """Replace Nodes with Aliases. Assumes recursion has been resolved in replacement_map"""
-
-    def __init__(self, replacement_map: Dict[TypeAnnotationNode, TypeAnnotationNode]):
-        self.__replacement_map = replacement_map
-
-    def __replace_full(self, node: TypeAnnotationNode) -> Tuple[TypeAnnotationNode, bool]:
-        replaced = False
-        seen_names = {node}
-        while node in self.__replacement_map:
-            node = self.__replacement_map[node]
-            replaced = True
-            if node in seen_names:
-                print(f"WARNING: Circle between {seen_names}. Picking the {node} for now.")
-                break
+_NOT_AN_ALIAS = object()
+
+
+class AliasResolver:
+    """
+    Follows the chains of aliases, e.g. from an imported name to its default name.
+
+    The aliases of a resolver override those of its parent, e.g. the aliases of a project
+    override those of the typing rules. The chain of each alias is followed once and remembered
+    until an alias is added, and a cycle is reported when the alias that closes it is added.
+    An overlay (e.g. the imports of a file) shares a dict that may still change, so it is meant
+    to be used once and thrown away. The parent of a resolver should not change while it is used.
+
+    The nodes are interned, so they are looked up by id, which is faster than by their hash. The
+    ids are not reused since the tables keep the nodes alive.
+    """
+
+    def __init__(
+        self,
+        aliases: Optional[Dict[TypeAnnotationNode, TypeAnnotationNode]] = None,
+        parent: Optional["AliasResolver"] = None,
+        overlaid_aliases: Optional[Dict[TypeAnnotationNode, TypeAnnotationNode]] = None,
+    ):
+        self.__parent = parent
+        self.__aliases = {}  # type: Dict[int, Tuple[TypeAnnotationNode, TypeAnnotationNode]]
+        self.__overlaid_aliases = overlaid_aliases
+        # The ids of the aliases of this resolver and of its ancestors. An overlay adds no ids, so
+        # it shares the set of its parent instead of copying it.
+        self.__alias_ids: Set[int] = set()
+        if overlaid_aliases is not None:
+            self.__alias_ids = parent.__alias_ids
+        elif parent is not None:
+            self.__alias_ids.update(parent.__alias_ids)
+        # The chains, by the id of their first node.
+        self.__chains = {}  # type: Dict[int, Tuple[TypeAnnotationNode, ...]]
+        if aliases is not None:
+            for alias, name in aliases.items():
+                self.add(alias, name)
+
+    def overlay(self, aliases: Dict[TypeAnnotationNode, TypeAnnotationNode]) -> "AliasResolver":
+        """A resolver of the aliases on top of this one. The dict is shared, not copied."""
+        return AliasResolver(parent=self, overlaid_aliases=aliases)
+
+    def add(self, alias: TypeAnnotationNode, name: TypeAnnotationNode) -> None:
+        assert self.__overlaid_aliases is None, "Add the aliases of an overlay to its dict."
+        self.__aliases[id(alias)] = alias, name
+        self.__alias_ids.add(id(alias))
+        self.__chains.clear()
+        chain = self.chain(alias)
+        if chain[-1] is alias:
+            print(f"WARNING: Circle between {set(chain)}. Picking the {alias} for now.")
+
+    def clear(self) -> None:
+        assert self.__overlaid_aliases is None, "The ids of an overlay are those of its parent."
+        self.__aliases.clear()
+        # Cleared in place, since the overlays share the set.
+        self.__alias_ids.clear()
+        if self.__parent is not None:
+            self.__alias_ids.update(self.__parent.__alias_ids)
+        self.__chains.clear()
+
+    def resolve(self, node: TypeAnnotationNode) -> Tuple[TypeAnnotationNode, bool]:
+        """The end of the chain of aliases of the node, and whether the node is an alias."""
+        chain = self.chain(node)
+        return chain[-1], len(chain) > 1
+
+    def chain(self, node: TypeAnnotationNode) -> Tuple[TypeAnnotationNode, ...]:
+        """
+        The node followed by the aliases it resolves to. In a cycle, the chain ends with the first
+        node that is seen twice.
+        """
+        chain = self.__chains.get(id(node))
+        if chain is not None:
+            return chain
+        if id(node) not in self.__alias_ids and (
+            self.__overlaid_aliases is None or node not in self.__overlaid_aliases
+        ):
+            return (node,)
+        chain = self.__follow(node)
+        self.__chains[id(node)] = chain
+        if chain[-1] not in chain[:-1]:
+            # Without a cycle, the chains of the next aliases are suffixes of this one.
+            for i in range(1, len(chain) - 1):
+                self.__chains[id(chain[i])] = chain[i:]
+        return chain
+
+    def __alias_of(self, node: TypeAnnotationNode) -> Any:
+        """The name of the alias in this resolver, ignoring the parent, or _NOT_AN_ALIAS."""
+        if self.__overlaid_aliases is not None:
+            return self.__overlaid_aliases.get(node, _NOT_AN_ALIAS)
+        alias_and_name = self.__aliases.get(id(node))
+        return alias_and_name[1] if alias_and_name is not None else _NOT_AN_ALIAS
+
+    def __follow(self, node: TypeAnnotationNode) -> Tuple[TypeAnnotationNode, ...]:
+        chain = [node]
+        seen = {id(node)}
+        while True:
+            name = self.__alias_of(node)
+            if name is not _NOT_AN_ALIAS:
+                next_nodes = (name,)
+            elif self.__parent is not None:
+                # Follow the chain of the parent until one of its nodes is overridden here.
+                next_nodes = self.__parent.chain(node)[1:]
             else:
-                seen_names.add(node)
-        return node, replaced
+                next_nodes = ()
+            if len(next_nodes) == 0:
+                return tuple(chain)
+            for node in next_nodes:
+                chain.append(node)
+                if id(node) in seen:
+                    return tuple(chain)
+                seen.add(id(node))
+                if self.__alias_of(node) is not _NOT_AN_ALIAS:
+                    break
+
+
+class AliasReplacementVisitor(TypeAnnotationVisitor):
+    """
+    Replace Nodes with Aliases. Assumes recursion has been resolved in replacement_map.
+    Returns the original node if nothing was replaced.
+    """
+
+    def __init__(
+        self,
+        replacement_map: Union[Dict[TypeAnnotationNode, TypeAnnotationNode], AliasResolver],
+    ):
+        if not isinstance(replacement_map, AliasResolver):
+            replacement_map = AliasResolver(replacement_map)
+        self.__replace_full = replacement_map.resolve
 
     def visit_subscript_annotation(self, node: SubscriptAnnotationNode):
         replacement, replaced = self.__replace_full(node)
         if replaced:
             return replacement
-        return SubscriptAnnotationNode(
-            value=node.value.accept_visitor(self),
-            slice=node.slice.accept_visitor(self) if node.slice is not None else None,
-        )
+        value = node.value.accept_visitor(self)
+        slice = node.slice.accept_visitor(self) if node.slice is not None else None
+        if value is node.value and slice is node.slice:
+            return node
+        return SubscriptAnnotationNode(value=value, slice=slice)
 
     def visit_tuple_annotation(self, node: TupleAnnotationNode):
         replacement, replaced = self.__replace_full(node)
         if replaced:
             return replacement
-        return TupleAnnotationNode((e.accept_visitor(self) for e in node.elements))
+        elements = tuple(e.accept_visitor(self) for e in node.elements)
+        if elements == node.elements:  # The nodes are interned, so this compares their identity.
+            return node
+        return TupleAnnotationNode(elements)
 
     def visit_name_annotation(self, node):
         return self.__replace_full(node)[0]
@@ -55,19 +170,28 @@ class AliasReplacementVisitor(TypeAnnotationVisitor):
         replacement, replaced = self.__replace_full(node)
         if replaced:
             return replacement
-        return ListAnnotationNode((e.accept_visitor(self) for e in node.elements))
+        elements = tuple(e.accept_visitor(self) for e in node.elements)
+        if elements == node.elements:
+            return node
+        return ListAnnotationNode(elements)
 
     def visit_attribute_annotation(self, node: AttributeAnnotationNode):
         replacement, replaced = self.__replace_full(node)
         if replaced:
             return replacement
-        return AttributeAnnotationNode(node.value.accept_visitor(self), node.attribute)
+        value = node.value.accept_visitor(self)
+        if value is node.value:
+            return node
+        return AttributeAnnotationNode(value, node.attribute)
 
     def visit_index_annotation(self, node: IndexAnnotationNode):
         replacement, replaced = self.__replace_full(node)
         if replaced:
             return replacement
-        return IndexAnnotationNode(node.value.accept_visitor(self))
+        value = node.value.accept_visitor(self)
+        if value is node.value:
+            return node
+        return IndexAnnotationNode(value)
 
     def visit_elipsis_annotation(self, node: ElipsisAnnotationNode):
         return node
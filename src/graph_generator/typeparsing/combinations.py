@@ -0,0 +1,55 @@
+import random
+import zlib
+from itertools import product
+from typing import List, Sequence, Tuple, TypeVar
+
+from .nodes import TypeAnnotationNode
+
+__all__ = ["CombinationBudget"]
+
+T = TypeVar("T")
+
+
+class CombinationBudget:
+    """
+    Bounds the number of combinations of the options of the elements of a type, e.g. of the
+    supertypes of each element of a tuple. Above the limit, a sample of the combinations is
+    drawn without enumerating them all. The sample is seeded by the type and drawn from the
+    options sorted by their repr, since they may come from sets (e.g. the supertypes of a type).
+    So the same type always gives the same combinations, whatever the hash seed.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.num_exceeded = 0  # The number of types with more combinations than the limit
+        self.num_dropped = 0  # The number of combinations left out of the samples
+
+    def reset(self) -> None:
+        self.num_exceeded, self.num_dropped = 0, 0
+
+    def product(
+        self, options: Sequence[Sequence[T]], node: TypeAnnotationNode
+    ) -> List[Tuple[T, ...]]:
+        """The combinations of the options in the order of itertools.product, or a sample of them."""
+        num_combinations = 1
+        for element_options in options:
+            num_combinations *= len(element_options)
+        if num_combinations <= self.limit:
+            return list(product(*options))
+
+        self.num_exceeded += 1
+        self.num_dropped += num_combinations - self.limit
+        rng = random.Random(zlib.crc32(repr(node).encode()))
+        options = [sorted(element_options, key=repr) for element_options in options]
+        # rng.sample(range(num_combinations), ...) overflows above 2**63 combinations.
+        indices = set()
+        while len(indices) < self.limit:
+            indices.add(rng.randrange(num_combinations))
+        combinations = []
+        for index in sorted(indices):
+            combination = []
+            for element_options in reversed(options):
+                index, element_index = divmod(index, len(element_options))
+                combination.append(element_options[element_index])
+            combinations.append(tuple(reversed(combination)))
+        return combinations
@@ -1,5 +1,4 @@
-from itertools import product
-
+from .combinations import CombinationBudget
 from .nodes import (
     SubscriptAnnotationNode,
     TupleAnnotationNode,
@@ -16,8 +15,8 @@ __all__ = ["EraseOnceTypeRemoval"]
 class EraseOnceTypeRemoval(TypeAnnotationVisitor):
     """Replace Nodes with Aliases. Assumes recursion has been resolved in replacement_map"""
 
-    def __init__(self):
-        pass
+    def __init__(self, limit_combinations_to: int = 10000):
+        self.budget = CombinationBudget(limit_combinations_to)
 
     def visit_subscript_annotation(self, node: SubscriptAnnotationNode):
         if node.slice is None:
@@ -38,7 +37,7 @@ class EraseOnceTypeRemoval(TypeAnnotationVisitor):
 
         erasure_happened_before = any(e[1] for e in elements)
         return (
-            [TupleAnnotationNode(t) for t in product(*(e[0] for e in elements))],
+            [TupleAnnotationNode(t) for t in self.budget.product([e[0] for e in elements], node)],
             erasure_happened_before,
         )
 
@@ -50,7 +49,7 @@ class EraseOnceTypeRemoval(TypeAnnotationVisitor):
 
         erasure_happened_before = any(e[1] for e in elements)
         return (
-            [ListAnnotationNode(t) for t in product(*(e[0] for e in elements))],
+            [ListAnnotationNode(t) for t in self.budget.product([e[0] for e in elements], node)],
             erasure_happened_before,
         )
 
@@ -1,7 +1,6 @@
-from itertools import product
 from typing import Callable, Iterator, Set
-import random
 
+from .combinations import CombinationBudget
 from .nodes import (
     TypeAnnotationNode,
     SubscriptAnnotationNode,
@@ -27,7 +26,7 @@ class DirectInheritanceRewriting(TypeAnnotationVisitor):
     ):
         self.__is_a = is_a_info
         self.__non_generic_types = non_generic_types
-        self.__limit_combinations_to = limit_combinations_to
+        self.budget = CombinationBudget(limit_combinations_to)
 
     def visit_subscript_annotation(self, node: SubscriptAnnotationNode):
         value_node_options = node.value.accept_visitor(self)
@@ -36,6 +35,17 @@ class DirectInheritanceRewriting(TypeAnnotationVisitor):
         else:
             slice_node_options = node.slice.accept_visitor(self)
 
+        generic_value_node_options = [
+            v for v in value_node_options if v not in self.__non_generic_types
+        ]
+        if len(generic_value_node_options) * len(slice_node_options) > self.budget.limit:
+            return [v for v in value_node_options if v in self.__non_generic_types] + [
+                SubscriptAnnotationNode(v, s)
+                for v, s in self.budget.product(
+                    [generic_value_node_options, slice_node_options], node
+                )
+            ]
+
         all_children = []
         for v in value_node_options:
             if v in self.__non_generic_types:
@@ -48,23 +58,14 @@ class DirectInheritanceRewriting(TypeAnnotationVisitor):
 
     def visit_tuple_annotation(self, node: TupleAnnotationNode):
         all_elements_options = [e.accept_visitor(self) for e in node.elements]
-        r = [TupleAnnotationNode(t) for t in product(*all_elements_options)]
-
-        if len(r) > self.__limit_combinations_to:
-            random.shuffle(r)
-            return r[: self.__limit_combinations_to]
-        return r
+        return [TupleAnnotationNode(t) for t in self.budget.product(all_elements_options, node)]
 
     def visit_name_annotation(self, node):
         return [node] + list(self.__is_a(node))
 
     def visit_list_annotation(self, node: ListAnnotationNode):
         all_elements_options = [e.accept_visitor(self) for e in node.elements]
-        r = [ListAnnotationNode(t) for t in product(*all_elements_options)]
-        if len(r) > self.__limit_combinations_to:
-            random.shuffle(r)
-            return r[: self.__limit_combinations_to]
-        return r
+        return [ListAnnotationNode(t) for t in self.budget.product(all_elements_options, node)]
 
     def visit_attribute_annotation(self, node: AttributeAnnotationNode):
         v = [node] + list(self.__is_a(node))
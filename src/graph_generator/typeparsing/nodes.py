@@ -1,6 +1,11 @@
+import keyword
+import re
+import string
 import traceback
+import weakref
 from abc import ABC, abstractmethod
-from typing import Any, Optional, Iterator
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Iterator, Tuple
 
 import typed_ast
 from typed_ast.ast3 import parse
@@ -21,6 +26,7 @@ __all__ = [
     "UnknownAnnotationNode",
     "parse_type_annotation_node",
     "parse_type_comment",
+    "parse_cache_stats",
 ]
 
 
@@ -28,17 +34,113 @@ class FaultyAnnotation(Exception):
     pass
 
 
+# The live nodes, by their class and fields. The child nodes in the fields are interned too, so
+# they are keyed by their id, which is not reused while the node, and thus its children, lives.
+_interned_nodes = {}  # type: Dict[Tuple, weakref.ref]
+
+
+def _forget_node(ref: weakref.ref, key: Tuple) -> None:
+    if _interned_nodes.get(key) is ref:
+        del _interned_nodes[key]
+
+
+def _size(node: Optional["TypeAnnotationNode"]) -> int:
+    return node.size() if node is not None else 0
+
+
+def _depth(node: Optional["TypeAnnotationNode"]) -> int:
+    return node.depth() if node is not None else 0
+
+
 class TypeAnnotationNode(ABC):
-    @abstractmethod
+    """
+    The nodes are immutable and interned, so that structurally equal nodes are the same object
+    and equality is identity. Their hash, repr, size and depth are computed once, when first
+    needed, since many nodes of the rewritings are discarded without ever being used.
+    The fields of each node class are its __slots__, in the order of its constructor.
+    """
+
+    __slots__ = ("_hash", "_repr", "_size", "_depth", "__weakref__")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Setting the slots directly bypasses __setattr__, and is faster than object.__setattr__.
+        cls._field_setters = tuple(getattr(cls, name).__set__ for name in cls.__slots__)
+
+    @classmethod
+    def _intern(cls, key: Tuple, fields: Tuple) -> "TypeAnnotationNode":
+        ref = _interned_nodes.get(key)
+        node = ref() if ref is not None else None
+        if node is None:
+            node = object.__new__(cls)
+            for set_field, value in zip(cls._field_setters, fields):
+                set_field(node, value)
+            _interned_nodes[key] = weakref.ref(node, lambda ref, key=key: _forget_node(ref, key))
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __reduce__(self):
+        # Unpickled nodes are interned again.
+        return type(self), tuple(getattr(self, name) for name in type(self).__slots__)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            object.__setattr__(self, "_hash", self._compute_hash())
+            return self._hash
+
+    def __repr__(self):
+        try:
+            return self._repr
+        except AttributeError:
+            object.__setattr__(self, "_repr", self._compute_repr())
+            return self._repr
+
     def size(self) -> int:
+        try:
+            return self._size
+        except AttributeError:
+            object.__setattr__(self, "_size", self._compute_size())
+            return self._size
+
+    def depth(self) -> int:
+        """The number of nested nodes on the longest path from this node to a leaf."""
+        try:
+            return self._depth
+        except AttributeError:
+            object.__setattr__(self, "_depth", self._compute_depth())
+            return self._depth
+
+    @abstractmethod
+    def _compute_hash(self) -> int:
         pass
 
     @abstractmethod
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+    def _compute_repr(self) -> str:
         pass
 
     @abstractmethod
-    def __repr__(self):
+    def _compute_size(self) -> int:
+        pass
+
+    @abstractmethod
+    def _compute_depth(self) -> int:
+        pass
+
+    @abstractmethod
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
         pass
 
     @staticmethod
@@ -48,30 +150,25 @@ class TypeAnnotationNode(ABC):
 
 
 class SubscriptAnnotationNode(TypeAnnotationNode):
-    def __init__(self, value: TypeAnnotationNode, slice: Optional[TypeAnnotationNode]):
-        self.value = value
-        self.slice = slice
+    __slots__ = ("value", "slice")
 
-    def size(self) -> int:
-        size = 1 + self.value.size()
-        if self.slice is not None:
-            size += self.slice.size()
-        return size
+    def __new__(cls, value: TypeAnnotationNode, slice: Optional[TypeAnnotationNode]):
+        return cls._intern((cls, id(value), id(slice)), (value, slice))
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_subscript_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return hash(self.value) ^ (hash(self.slice) + 13)
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return repr(self.value) + "[" + repr(self.slice) + "]"
 
-    def __hash__(self):
-        return hash(self.value) ^ (hash(self.slice) + 13)
+    def _compute_size(self) -> int:
+        return 1 + self.value.size() + _size(self.slice)
 
-    def __eq__(self, other):
-        if not isinstance(other, SubscriptAnnotationNode):
-            return False
-        else:
-            return self.value == other.value and self.slice == other.slice
+    def _compute_depth(self) -> int:
+        return 1 + max(self.value.depth(), _depth(self.slice))
+
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_subscript_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "SubscriptAnnotationNode":
@@ -85,29 +182,29 @@ class SubscriptAnnotationNode(TypeAnnotationNode):
 
 
 class TupleAnnotationNode(TypeAnnotationNode):
-    def __init__(self, elements: Iterator[TypeAnnotationNode]):
-        self.elements = tuple(elements)
+    __slots__ = ("elements",)
 
-    def size(self) -> int:
-        return sum(e.size() for e in self.elements) + 1
-
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_tuple_annotation(self, *args)
-
-    def __repr__(self):
-        return ", ".join(repr(e) for e in self.elements)
+    def __new__(cls, elements: Iterator[TypeAnnotationNode]):
+        elements = tuple(elements)
+        return cls._intern((cls,) + tuple(map(id, elements)), (elements,))
 
-    def __hash__(self):
+    def _compute_hash(self) -> int:
         if len(self.elements) > 0:
             return hash(self.elements)
         else:
             return 1
 
-    def __eq__(self, other):
-        if not isinstance(other, TupleAnnotationNode):
-            return False
-        else:
-            return self.elements == other.elements
+    def _compute_repr(self) -> str:
+        return ", ".join([repr(e) for e in self.elements])
+
+    def _compute_size(self) -> int:
+        return sum([_size(e) for e in self.elements]) + 1
+
+    def _compute_depth(self) -> int:
+        return 1 + max([_depth(e) for e in self.elements], default=0)
+
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_tuple_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "TupleAnnotationNode":
@@ -116,25 +213,25 @@ class TupleAnnotationNode(TypeAnnotationNode):
 
 
 class NameAnnotationNode(TypeAnnotationNode):
-    def __init__(self, identifier: str):
-        self.identifier = identifier
+    __slots__ = ("identifier",)
 
-    def size(self) -> int:
-        return 1
+    def __new__(cls, identifier: str):
+        return cls._intern((cls, identifier), (identifier,))
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_name_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return hash(self.identifier)
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return self.identifier
 
-    def __hash__(self):
-        return hash(self.identifier)
+    def _compute_size(self) -> int:
+        return 1
+
+    def _compute_depth(self) -> int:
+        return 1
 
-    def __eq__(self, other):
-        if not isinstance(other, NameAnnotationNode):
-            return False
-        return self.identifier == other.identifier
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_name_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "NameAnnotationNode":
@@ -143,28 +240,29 @@ class NameAnnotationNode(TypeAnnotationNode):
 
 
 class ListAnnotationNode(TypeAnnotationNode):
-    def __init__(self, elements: Iterator[TypeAnnotationNode]):
-        self.elements = tuple(elements)
+    __slots__ = ("elements",)
 
-    def size(self) -> int:
-        return sum(e.size() for e in self.elements) + 1
-
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_list_annotation(self, *args)
-
-    def __repr__(self):
-        return "[" + ", ".join(repr(e) for e in self.elements) + "]"
+    def __new__(cls, elements: Iterator[TypeAnnotationNode]):
+        elements = tuple(elements)
+        return cls._intern((cls,) + tuple(map(id, elements)), (elements,))
 
-    def __hash__(self):
+    def _compute_hash(self) -> int:
         if len(self.elements) > 0:
             return hash(self.elements)
         else:
             return 2
 
-    def __eq__(self, other):
-        if not isinstance(other, ListAnnotationNode):
-            return False
-        return self.elements == other.elements
+    def _compute_repr(self) -> str:
+        return "[" + ", ".join([repr(e) for e in self.elements]) + "]"
+
+    def _compute_size(self) -> int:
+        return sum([_size(e) for e in self.elements]) + 1
+
+    def _compute_depth(self) -> int:
+        return 1 + max([_depth(e) for e in self.elements], default=0)
+
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_list_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "ListAnnotationNode":
@@ -173,28 +271,26 @@ class ListAnnotationNode(TypeAnnotationNode):
 
 
 class AttributeAnnotationNode(TypeAnnotationNode):
-    def __init__(self, value: TypeAnnotationNode, attribute: str):
-        self.value = value
-        assert isinstance(attribute, str), type(attribute)
-        self.attribute = attribute
+    __slots__ = ("value", "attribute")
 
-    def size(self) -> int:
-        return 1 + self.value.size()
+    def __new__(cls, value: TypeAnnotationNode, attribute: str):
+        assert isinstance(attribute, str), type(attribute)
+        return cls._intern((cls, id(value), attribute), (value, attribute))
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_attribute_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return hash(self.attribute) ^ (hash(self.value) + 13)
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return repr(self.value) + "." + self.attribute
 
-    def __hash__(self):
-        return hash(self.attribute) ^ (hash(self.value) + 13)
+    def _compute_size(self) -> int:
+        return 1 + _size(self.value)
 
-    def __eq__(self, other):
-        if not isinstance(other, AttributeAnnotationNode):
-            return False
-        else:
-            return self.attribute == other.attribute and self.value == other.value
+    def _compute_depth(self) -> int:
+        return 1 + _depth(self.value)
+
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_attribute_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "AttributeAnnotationNode":
@@ -204,25 +300,25 @@ class AttributeAnnotationNode(TypeAnnotationNode):
 
 
 class IndexAnnotationNode(TypeAnnotationNode):
-    def __init__(self, value: TypeAnnotationNode):
-        self.value = value
+    __slots__ = ("value",)
 
-    def size(self) -> int:
-        return 1 + self.value.size()
+    def __new__(cls, value: TypeAnnotationNode):
+        return cls._intern((cls, id(value)), (value,))
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_index_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return hash(self.value)
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return repr(self.value)
 
-    def __hash__(self):
-        return hash(self.value)
+    def _compute_size(self) -> int:
+        return 1 + _size(self.value)
 
-    def __eq__(self, other):
-        if not isinstance(other, IndexAnnotationNode):
-            return False
-        return self.value == other.value
+    def _compute_depth(self) -> int:
+        return 1 + _depth(self.value)
+
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_index_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "IndexAnnotationNode":
@@ -231,23 +327,25 @@ class IndexAnnotationNode(TypeAnnotationNode):
 
 
 class ElipsisAnnotationNode(TypeAnnotationNode):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
-    def size(self) -> int:
-        return 1
+    def __new__(cls):
+        return cls._intern((cls,), ())
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_elipsis_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return 3
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return "..."
 
-    def __hash__(self):
-        return 3
+    def _compute_size(self) -> int:
+        return 1
+
+    def _compute_depth(self) -> int:
+        return 1
 
-    def __eq__(self, other):
-        return isinstance(other, ElipsisAnnotationNode)
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_elipsis_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "ElipsisAnnotationNode":
@@ -255,25 +353,26 @@ class ElipsisAnnotationNode(TypeAnnotationNode):
 
 
 class NameConstantAnnotationNode(TypeAnnotationNode):
-    def __init__(self, value: Any):
-        self.value = value
+    __slots__ = ("value",)
 
-    def size(self) -> int:
-        return 1
+    def __new__(cls, value: Any):
+        # Keyed by the type of the value too, so that e.g. True and 1 are different nodes.
+        return cls._intern((cls, type(value), value), (value,))
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_name_constant_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return hash(self.value)
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return repr(self.value)
 
-    def __hash__(self):
-        return hash(self.value)
+    def _compute_size(self) -> int:
+        return 1
+
+    def _compute_depth(self) -> int:
+        return 1
 
-    def __eq__(self, other):
-        if not isinstance(other, NameConstantAnnotationNode):
-            return False
-        return self.value == other.value
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_name_constant_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "NameConstantAnnotationNode":
@@ -283,31 +382,167 @@ class NameConstantAnnotationNode(TypeAnnotationNode):
 
 
 class UnknownAnnotationNode(TypeAnnotationNode):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
-    def size(self) -> int:
-        return 1
+    def __new__(cls):
+        return cls._intern((cls,), ())
 
-    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
-        return visitor.visit_unknown_annotation(self, *args)
+    def _compute_hash(self) -> int:
+        return 4
 
-    def __repr__(self):
+    def _compute_repr(self) -> str:
         return "%UNKNOWN%"
 
-    def __hash__(self):
-        return 4
+    def _compute_size(self) -> int:
+        return 1
 
-    def __eq__(self, other):
-        return isinstance(other, UnknownAnnotationNode)
+    def _compute_depth(self) -> int:
+        return 1
+
+    def accept_visitor(self, visitor: TypeAnnotationVisitor, *args) -> Any:
+        return visitor.visit_unknown_annotation(self, *args)
 
     @staticmethod
     def parse(node) -> "UnknownAnnotationNode":
         raise NotImplementedError()
 
 
+# The annotation strings are usually parsed by a small recursive-descent parser over the common
+# subset of the annotation syntax: dotted names, subscripts, tuples, lists, ellipsis, None, True,
+# False and quoted forward references. This is much faster than parsing them as Python
+# expressions with typed_ast and converting the resulting tree. Anything outside of the subset,
+# including all the invalid annotations, raises _UnsupportedAnnotation and is parsed by typed_ast,
+# so that both paths always return the same node.
+# Every character other than a space is part of a token: an ellipsis, a name, a quoted string or
+# a single character, e.g. a punctuation.
+_ANNOTATION_TOKEN = re.compile(r"\.\.\.|[A-Za-z_]\w*|'[^'\\\r\n]*'|\"[^\"\\\r\n]*\"|[^ ]", re.ASCII)
+_END_TOKEN = ""
+_NAME_START = frozenset(string.ascii_letters + "_")
+_QUOTES = frozenset("'\"")
+_NAME_CONSTANTS = {"None": None, "True": True, "False": False}
+_KEYWORDS = frozenset(keyword.kwlist) | {"async", "await"}
+
+
+class _UnsupportedAnnotation(Exception):
+    pass
+
+
+def _tokenize_annotation(annotation: str) -> List[str]:
+    if annotation[:1] == " ":  # An IndentationError for typed_ast.
+        raise _UnsupportedAnnotation()
+    if "'''" in annotation or '"""' in annotation:  # Triple-quoted strings.
+        raise _UnsupportedAnnotation()
+    tokens = _ANNOTATION_TOKEN.findall(annotation)
+    tokens.append(_END_TOKEN)
+    return tokens
+
+
+class _AnnotationParser:
+    def __init__(self, annotation: str):
+        self.__tokens = _tokenize_annotation(annotation)
+        self.__position = 0
+
+    def parse(self) -> TypeAnnotationNode:
+        node = self.__expression_list(closing=_END_TOKEN)
+        if self.__tokens[self.__position] != _END_TOKEN:
+            raise _UnsupportedAnnotation()
+        return node
+
+    def __expect(self, punctuation: str) -> None:
+        if self.__tokens[self.__position] != punctuation:
+            raise _UnsupportedAnnotation()
+        self.__position += 1
+
+    def __expression_list(self, closing: str) -> TypeAnnotationNode:
+        """One expression, or a tuple of comma-separated expressions with an optional final comma."""
+        first = self.__expression()
+        if self.__tokens[self.__position] != ",":
+            return first
+        elements = [first]
+        while self.__tokens[self.__position] == ",":
+            self.__position += 1
+            token = self.__tokens[self.__position]
+            if token == closing or token == _END_TOKEN:
+                break
+            elements.append(self.__expression())
+        return TupleAnnotationNode(elements)
+
+    def __expression(self) -> TypeAnnotationNode:
+        tokens = self.__tokens
+        node = self.__atom()
+        while True:
+            token = tokens[self.__position]
+            if token == ".":
+                attribute = tokens[self.__position + 1]
+                if attribute[:1] not in _NAME_START or attribute in _KEYWORDS:
+                    raise _UnsupportedAnnotation()
+                self.__position += 2
+                node = AttributeAnnotationNode(node, attribute)
+            elif token == "[":
+                self.__position += 1
+                slice = self.__expression_list(closing="]")
+                self.__expect("]")
+                node = SubscriptAnnotationNode(node, IndexAnnotationNode(slice))
+            else:
+                return node
+
+    def __atom(self) -> TypeAnnotationNode:
+        tokens = self.__tokens
+        token = tokens[self.__position]
+        self.__position += 1
+        first_character = token[:1]
+        if first_character in _NAME_START:
+            if token in _NAME_CONSTANTS:
+                return NameConstantAnnotationNode(_NAME_CONSTANTS[token])
+            if token in _KEYWORDS:
+                raise _UnsupportedAnnotation()
+            return NameAnnotationNode(token)
+        elif first_character in _QUOTES:
+            # Adjacent strings are concatenated. A single quote is an unterminated string.
+            value = ""
+            while token[:1] in _QUOTES:
+                if len(token) == 1:
+                    raise _UnsupportedAnnotation()
+                value += token[1:-1]
+                token = tokens[self.__position]
+                self.__position += 1
+            self.__position -= 1
+            return _AnnotationParser(value).parse()
+        elif token == "...":
+            return ElipsisAnnotationNode()
+        elif token == "(":
+            if tokens[self.__position] == ")":
+                self.__position += 1
+                return TupleAnnotationNode(())
+            node = self.__expression_list(closing=")")
+            self.__expect(")")
+            return node
+        elif token == "[":
+            elements = []
+            while tokens[self.__position] != "]":
+                elements.append(self.__expression())
+                if tokens[self.__position] != ",":
+                    break
+                self.__position += 1
+            self.__expect("]")
+            return ListAnnotationNode(elements)
+        raise _UnsupportedAnnotation()
+
+
+def _parse_annotation_string(annotation: str) -> TypeAnnotationNode:
+    """Parse the annotation, or raise _UnsupportedAnnotation if typed_ast is needed."""
+    try:
+        return _AnnotationParser(annotation).parse()
+    except RecursionError:
+        raise _UnsupportedAnnotation()
+
+
 def _parse_string_annotation(node):
     assert hasattr(node, "s")
+    try:
+        return _parse_annotation_string(node.s)
+    except _UnsupportedAnnotation:
+        pass
     try:
         node = parse(node.s, "", mode="eval")
         return _parse_recursive(node.body)
@@ -355,7 +590,16 @@ def parse_type_annotation_node(node) -> Optional[TypeAnnotationNode]:
     return None
 
 
+@lru_cache(16384)
 def parse_type_comment(annotation: str) -> Optional[TypeAnnotationNode]:
+    """
+    Cached, since the same strings (e.g. the typing rules and repeated type comments) are parsed
+    over and over. The nodes are immutable, so the results can be shared.
+    """
+    try:
+        return _parse_annotation_string(annotation)
+    except _UnsupportedAnnotation:
+        pass
     try:
         node = parse(annotation, "", mode="eval")
     except SyntaxError:
@@ -364,3 +608,15 @@ def parse_type_comment(annotation: str) -> Optional[TypeAnnotationNode]:
         return _parse_recursive(node.body)
     except Exception as e:
         return None
+
+
+def parse_cache_stats() -> Dict[str, float]:
+    """The hits and misses of the cache of parse_type_comment in this process."""
+    info = parse_type_comment.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "hit_rate": info.hits / lookups if lookups > 0 else 0.0,
+    }
@@ -13,7 +13,7 @@ __all__ = ["PruneAnnotationVisitor"]
 
 
 class PruneAnnotationVisitor(TypeAnnotationVisitor):
-    """Prune Long Annotations"""
+    """Prune Long Annotations. Returns the original node if nothing was pruned."""
 
     def __init__(self, replacement_node: TypeAnnotationNode, max_list_size: int):
         self.__max_list_size = max_list_size
@@ -32,9 +32,10 @@ class PruneAnnotationVisitor(TypeAnnotationVisitor):
         else:
             pruned_slice = node.slice.accept_visitor(self, current_remaining_depth - 1)
 
-        return SubscriptAnnotationNode(
-            value=node.value.accept_visitor(self, current_remaining_depth - 1), slice=pruned_slice,
-        )
+        pruned_value = node.value.accept_visitor(self, current_remaining_depth - 1)
+        if pruned_value is node.value and pruned_slice is node.slice:
+            return node
+        return SubscriptAnnotationNode(value=pruned_value, slice=pruned_slice)
 
     def visit_tuple_annotation(self, node: TupleAnnotationNode, current_remaining_depth: int):
         if len(node.elements) > self.__max_list_size:
@@ -51,6 +52,9 @@ class PruneAnnotationVisitor(TypeAnnotationVisitor):
         else:
             pruned = (e.accept_visitor(self, current_remaining_depth - 1) for e in elements)
 
+        pruned = tuple(pruned)
+        if pruned == node.elements:  # The nodes are interned, so this compares their identity.
+            return node
         return TupleAnnotationNode(pruned)
 
     def visit_name_annotation(self, node, current_remaining_depth: int):
@@ -69,6 +73,9 @@ class PruneAnnotationVisitor(TypeAnnotationVisitor):
         else:
             pruned = (e.accept_visitor(self, current_remaining_depth - 1) for e in node.elements)
 
+        pruned = tuple(pruned)
+        if pruned == node.elements:
+            return node
         return ListAnnotationNode(pruned)
 
     def visit_attribute_annotation(
@@ -80,7 +87,10 @@ class PruneAnnotationVisitor(TypeAnnotationVisitor):
         if current_remaining_depth == 0:
             return self.__replacement_node
 
-        return IndexAnnotationNode(node.value.accept_visitor(self, current_remaining_depth))
+        pruned_value = node.value.accept_visitor(self, current_remaining_depth)
+        if pruned_value is node.value:
+            return node
+        return IndexAnnotationNode(pruned_value)
 
     def visit_elipsis_annotation(self, node, current_remaining_depth: int):
         return node
@@ -17,6 +17,8 @@ class RemoveGenericWithAnys(RewriteRule):
 
     ANY_NODE = parse_type_annotation_node("typing.Any")
 
+    NODE_CLASSES = (SubscriptAnnotationNode,)
+
     def matches(self, node: TypeAnnotationNode, parent: Optional[TypeAnnotationNode]) -> bool:
         if not isinstance(node, SubscriptAnnotationNode):
             return False
@@ -16,6 +16,9 @@ class RemoveRecursiveGenerics(RewriteRule):
 
     GENERIC_NODE = parse_type_annotation_node("typing.Generic")
 
+    NODE_CLASSES = (SubscriptAnnotationNode,)
+    HEAD_SYMBOLS = (GENERIC_NODE,)
+
     def matches(self, node: TypeAnnotationNode, parent: Optional[TypeAnnotationNode]) -> bool:
         if not isinstance(node, SubscriptAnnotationNode):
             return False
@@ -4,6 +4,7 @@ from graph_generator.typeparsing.nodes import (
     parse_type_annotation_node,
     TypeAnnotationNode,
     SubscriptAnnotationNode,
+    AttributeAnnotationNode,
 )
 from .rewriterule import RewriteRule
 
@@ -17,6 +18,9 @@ class RemoveStandAlones(RewriteRule):
     GENERIC_NODE = parse_type_annotation_node("typing.Generic")
     ANY_NODE = parse_type_annotation_node("typing.Any")
 
+    NODE_CLASSES = (AttributeAnnotationNode,)
+    HEAD_SYMBOLS = (UNION_NODE, OPTIONAL_NODE, GENERIC_NODE)
+
     def matches(self, node: TypeAnnotationNode, parent: Optional[TypeAnnotationNode]) -> bool:
         if (
             not node == self.UNION_NODE
@@ -18,6 +18,9 @@ class RemoveUnionWithAnys(RewriteRule):
     UNION_NODE = parse_type_annotation_node("typing.Union")
     ANY_NODE = parse_type_annotation_node("typing.Any")
 
+    NODE_CLASSES = (SubscriptAnnotationNode,)
+    HEAD_SYMBOLS = (UNION_NODE,)
+
     def matches(self, node: TypeAnnotationNode, parent: Optional[TypeAnnotationNode]) -> bool:
         if not isinstance(node, SubscriptAnnotationNode):
             return False
@@ -1,9 +1,16 @@
 from abc import ABC, abstractmethod
+from typing import Optional, Tuple, Type
 
 from graph_generator.typeparsing.nodes import TypeAnnotationNode
 
 
 class RewriteRule(ABC):
+    # The classes of the nodes that the rule may match, or None for any node.
+    NODE_CLASSES = None  # type: Optional[Tuple[Type[TypeAnnotationNode], ...]]
+    # The head symbols of the nodes that the rule may match, or None for any head. The head
+    # symbol of a subscript is its value, e.g. typing.Union, and any other node is its own head.
+    HEAD_SYMBOLS = None  # type: Optional[Tuple[TypeAnnotationNode, ...]]
+
     @abstractmethod
     def matches(self, node: TypeAnnotationNode, parent: TypeAnnotationNode) -> bool:
         pass
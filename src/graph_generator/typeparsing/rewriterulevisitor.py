@@ -1,4 +1,5 @@
-from typing import List
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 from .nodes import (
     TypeAnnotationNode,
@@ -14,47 +15,113 @@ from .visitor import TypeAnnotationVisitor
 
 
 class RewriteRuleVisitor(TypeAnnotationVisitor):
-    """Replace Nodes based on a list of rules."""
+    """
+    Replace Nodes based on a list of rules. Returns the original node if no rule applies.
 
-    def __init__(self, rules: List[RewriteRule]):
+    The rules are indexed by the class and the head symbol of the nodes that they may match (see
+    RewriteRule), so only the applicable rules are tested on each node, in the order of the list.
+    With fixpoint, the result of a rule is rewritten again, until no rule applies anywhere in it.
+    """
+
+    MAX_FIXPOINT_REWRITES = 100
+
+    def __init__(self, rules: List[RewriteRule], fixpoint: bool = False):
         self.__rules = rules
+        self.__fixpoint = fixpoint
+        self.__num_nested_rewrites = 0
+        # node class -> (the rules for any other head, head symbol -> the rules for that head)
+        self.__index = {}  # type: Dict[Type[TypeAnnotationNode], Tuple[Tuple, Dict[Any, Tuple]]]
+        self.rule_hits = Counter()  # type: Counter[str]  # The number of rewrites of each rule
+
+    def __index_rules(self, node_class: Type[TypeAnnotationNode]):
+        rules = [
+            r
+            for r in self.__rules
+            if r.NODE_CLASSES is None or issubclass(node_class, r.NODE_CLASSES)
+        ]
+        head_symbols = {h for r in rules if r.HEAD_SYMBOLS is not None for h in r.HEAD_SYMBOLS}
+        rules_by_head = {
+            head: tuple(r for r in rules if r.HEAD_SYMBOLS is None or head in r.HEAD_SYMBOLS)
+            for head in head_symbols
+        }
+        index = tuple(r for r in rules if r.HEAD_SYMBOLS is None), rules_by_head
+        self.__index[node_class] = index
+        return index
+
+    def __matching_rule(
+        self, node: TypeAnnotationNode, parent: Optional[TypeAnnotationNode]
+    ) -> Optional[RewriteRule]:
+        node_class = type(node)
+        index = self.__index.get(node_class)
+        if index is None:
+            index = self.__index_rules(node_class)
+        rules_for_any_head, rules_by_head = index
+        if len(rules_by_head) > 0:
+            head = node.value if node_class is SubscriptAnnotationNode else node
+            rules = rules_by_head.get(head, rules_for_any_head)
+        else:
+            rules = rules_for_any_head
+        for rule in rules:
+            if rule.matches(node, parent):
+                return rule
+        return None
 
     def __apply_on_match(
         self, original_node: TypeAnnotationNode, parent: TypeAnnotationNode
     ) -> TypeAnnotationNode:
-        for rule in self.__rules:
-            if rule.matches(original_node, parent):
-                return rule.apply(original_node)
-        return original_node
+        rule = self.__matching_rule(original_node, parent)
+        if rule is None:
+            return original_node
+        self.rule_hits[type(rule).__name__] += 1
+        rewritten = rule.apply(original_node)
+        if not self.__fixpoint or rewritten is original_node:
+            return rewritten
+
+        if self.__num_nested_rewrites >= self.MAX_FIXPOINT_REWRITES:
+            print(f"WARNING: The rewrite rules do not converge on {original_node}. Stopping.")
+            return rewritten
+        self.__num_nested_rewrites += 1
+        try:
+            return rewritten.accept_visitor(self, parent)
+        finally:
+            self.__num_nested_rewrites -= 1
 
     def visit_subscript_annotation(
         self, node: SubscriptAnnotationNode, parent: TypeAnnotationNode
     ) -> SubscriptAnnotationNode:
-        node = SubscriptAnnotationNode(
-            value=node.value.accept_visitor(self, node),
-            slice=node.slice.accept_visitor(self, node) if node.slice is not None else None,
-        )
+        value = node.value.accept_visitor(self, node)
+        slice = node.slice.accept_visitor(self, node) if node.slice is not None else None
+        if value is not node.value or slice is not node.slice:
+            node = SubscriptAnnotationNode(value=value, slice=slice)
         return self.__apply_on_match(node, parent)
 
     def visit_tuple_annotation(
         self, node: TupleAnnotationNode, parent: TypeAnnotationNode
     ) -> TupleAnnotationNode:
-        node = TupleAnnotationNode((e.accept_visitor(self, node) for e in node.elements))
+        elements = tuple(e.accept_visitor(self, node) for e in node.elements)
+        if elements != node.elements:  # The nodes are interned, so this compares their identity.
+            node = TupleAnnotationNode(elements)
         return self.__apply_on_match(node, parent)
 
     def visit_name_annotation(self, node, parent: TypeAnnotationNode):
         return self.__apply_on_match(node, parent)
 
     def visit_list_annotation(self, node: ListAnnotationNode, parent: TypeAnnotationNode):
-        node = ListAnnotationNode((e.accept_visitor(self, node) for e in node.elements))
+        elements = tuple(e.accept_visitor(self, node) for e in node.elements)
+        if elements != node.elements:
+            node = ListAnnotationNode(elements)
         return self.__apply_on_match(node, parent)
 
     def visit_attribute_annotation(self, node: AttributeAnnotationNode, parent: TypeAnnotationNode):
-        node = AttributeAnnotationNode(node.value.accept_visitor(self, node), node.attribute)
+        value = node.value.accept_visitor(self, node)
+        if value is not node.value:
+            node = AttributeAnnotationNode(value, node.attribute)
         return self.__apply_on_match(node, parent)
 
     def visit_index_annotation(self, node: IndexAnnotationNode, parent: TypeAnnotationNode):
-        node = IndexAnnotationNode(node.value.accept_visitor(self, node))
+        value = node.value.accept_visitor(self, node)
+        if value is not node.value:
+            node = IndexAnnotationNode(value)
         return self.__apply_on_match(node, parent)
 
     def visit_elipsis_annotation(self, node: ElipsisAnnotationNode, parent: TypeAnnotationNode):
@@ -0,0 +1,77 @@
+"""
+Report the import cost of each module, as measured by `python -X importtime` in a fresh
+interpreter, to track cold-start regressions.
+
+Usage:
+    importtimes.py [options] [MODULE ...]
+
+Options:
+    --top=K                    Show the K most expensive modules. [default: 25]
+    -h --help                  Show this screen.
+"""
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+from docopt import docopt
+
+# The modules imported by the action before and after the diff has been analyzed.
+ACTION_MODULES = [
+    "changeutils",
+    "annotationutils",
+    "githubclient",
+    "typesuggestions",
+    "predictioncache",
+    "inferenceserver",
+    "ptgnn.implementations.typilus.graph2class",
+]
+
+
+class ImportTime(NamedTuple):
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def measure_import_times(modules: List[str]) -> List[ImportTime]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH")) if p
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "".join(f"import {m}\n" for m in modules)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    import_times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # The header line
+        module = name.strip()
+        depth = (len(name.rstrip()) - len(module) - 1) // 2
+        import_times.append(ImportTime(module, depth, int(self_us), int(cumulative_us)))
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1])
+    return import_times
+
+
+def print_import_time_report(modules: List[str] = ACTION_MODULES, top_k: int = 25) -> None:
+    import_times = measure_import_times(modules)
+    total_us = sum(t.cumulative_us for t in import_times if t.depth == 0)
+    print(f"Import time report: {total_us / 1e6:.2f}s in total")
+    print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  module")
+    for t in sorted(import_times, key=lambda t: -t.cumulative_us)[:top_k]:
+        print(f"{t.cumulative_us / 1e3:16.1f} {t.self_us / 1e3:10.1f}  {'  ' * t.depth}{t.module}")
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    print_import_time_report(args["MODULE"] or ACTION_MODULES, int(args["--top"]))
@@ -0,0 +1,188 @@
+"""
+A long-running Typilus inference server. The model is restored once at startup and each
+request only pays for graph extraction and inference.
+
+Usage:
+    inferenceserver.py [options]
+
+Options:
+    --host=HOST                The interface to listen on. [default: 127.0.0.1]
+    --port=PORT                The port to listen on. [default: 8339]
+    --model-path=PATH          The path to the model. Defaults to $MODEL_PATH or /usr/src/model.pkl.gz
+    --typing-rules=PATH        The path to the typing rules. Defaults to metadata/typingRules.json
+    --cache-dir=DIR            Cache the predictions of each file content in this folder.
+    --cache-max-size-mb=SIZE   The maximum size of the prediction cache. [default: 512]
+    --jobs=J                   The number of worker processes extracting graphs. [default: 1]
+    --debug                    Print the predictions of each request.
+    -h --help                  Show this screen.
+"""
+
+import json
+import os
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional, Set
+
+import requests
+from docopt import docopt
+
+from predictioncache import PredictionCache
+from typesuggestions import (
+    DEFAULT_TYPING_RULES_PATH,
+    TypeSuggestion,
+    compute_type_suggestions,
+    restore_model,
+)
+
+DEFAULT_MODEL_PATH = "/usr/src/model.pkl.gz"
+
+
+class InferenceServer(HTTPServer):
+    """
+    Serves `POST /analyze` jobs of the form
+        {"repo_path": str, "changed_files": {filepath: [lineno]}, "suggestion_confidence_threshold": float}
+    and responds with `{"suggestions": [TypeSuggestion.to_json()]}`.
+    """
+
+    def __init__(
+        self,
+        address,
+        model_path: str,
+        typing_rules_path: str,
+        prediction_cache: Optional[PredictionCache] = None,
+        jobs: int = 1,
+        debug: bool = False,
+    ):
+        super().__init__(address, _InferenceRequestHandler)
+        start_time = time.time()
+        self.model, self.nn = restore_model(model_path)
+        print(f"Model restored in {time.time() - start_time:.2f} seconds.")
+        self.typing_rules_path = typing_rules_path
+        self.prediction_cache = prediction_cache
+        self.jobs = jobs
+        self.debug = debug
+
+    def analyze(self, job: Dict[str, Any]) -> List[TypeSuggestion]:
+        changed_files: Dict[str, Set[int]] = {
+            filepath: set(lines) for filepath, lines in job["changed_files"].items()
+        }
+        # A fresh TypeLatticeGenerator is cheaper to construct than to deep-copy a warm one.
+        return compute_type_suggestions(
+            job["repo_path"],
+            changed_files,
+            self.model,
+            self.nn,
+            suggestion_confidence_threshold=float(job.get("suggestion_confidence_threshold", 0.5)),
+            typing_rules_path=self.typing_rules_path,
+            prediction_cache=self.prediction_cache,
+            jobs=self.jobs,
+            debug=self.debug,
+        )
+
+
+def _check_job(job: Any) -> None:
+    """Raise a ValueError if the job does not have the form documented in InferenceServer."""
+    if not isinstance(job, dict):
+        raise ValueError("the job must be a JSON object")
+    if not isinstance(job.get("repo_path"), str):
+        raise ValueError("repo_path must be a string")
+    changed_files = job.get("changed_files")
+    if not isinstance(changed_files, dict) or not all(
+        isinstance(lines, list) and all(type(line) is int for line in lines)
+        for lines in changed_files.values()
+    ):
+        raise ValueError("changed_files must map each file path to a list of line numbers")
+    threshold = job.get("suggestion_confidence_threshold", 0.5)
+    if type(threshold) not in (int, float):
+        raise ValueError("suggestion_confidence_threshold must be a number")
+
+
+class _InferenceRequestHandler(BaseHTTPRequestHandler):
+    server: InferenceServer
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.__send_json(200, {"status": "ok"})
+        else:
+            self.__send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/analyze":
+            self.__send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(content_length))
+            _check_job(job)
+        except (ValueError, json.JSONDecodeError) as e:
+            self.__send_json(400, {"error": f"Malformed job: {e}"})
+            return
+
+        start_time = time.time()
+        try:
+            suggestions = self.server.analyze(job)
+        except Exception as e:
+            print(traceback.format_exc())
+            self.__send_json(500, {"error": str(e)})
+            return
+        print(
+            f"Analyzed {len(job['changed_files'])} files in {time.time() - start_time:.2f} seconds."
+        )
+        self.__send_json(200, {"suggestions": [s.to_json() for s in suggestions]})
+
+    def __send_json(self, status_code: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def request_type_suggestions(
+    server_url: str,
+    repo_path: str,
+    changed_files: Dict[str, Set[int]],
+    suggestion_confidence_threshold: float,
+    timeout: float = 600,
+) -> List[TypeSuggestion]:
+    """Ask a running inference server for the type suggestions of the changed files."""
+    job = {
+        "repo_path": os.path.abspath(repo_path),
+        "changed_files": {filepath: sorted(lines) for filepath, lines in changed_files.items()},
+        "suggestion_confidence_threshold": suggestion_confidence_threshold,
+    }
+    r = requests.post(server_url.rstrip("/") + "/analyze", json=job, timeout=timeout)
+    r.raise_for_status()
+    return [TypeSuggestion.from_json(s) for s in r.json()["suggestions"]]
+
+
+def main(args):
+    model_path = args["--model-path"] or os.getenv("MODEL_PATH", DEFAULT_MODEL_PATH)
+    typing_rules_path = args["--typing-rules"] or DEFAULT_TYPING_RULES_PATH
+    prediction_cache = None
+    if args["--cache-dir"] is not None:
+        prediction_cache = PredictionCache(
+            args["--cache-dir"],
+            model_path,
+            typing_rules_path,
+            max_size_bytes=int(float(args["--cache-max-size-mb"]) * 2 ** 20),
+        )
+    server = InferenceServer(
+        (args["--host"], int(args["--port"])),
+        model_path,
+        typing_rules_path,
+        prediction_cache=prediction_cache,
+        jobs=int(args["--jobs"]),
+        debug=args["--debug"],
+    )
+    print(f"Serving Typilus suggestions on {args['--host']}:{args['--port']}...")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(docopt(__doc__))
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from graph_generator.graphgenerator import GRAPH_GENERATOR_VERSION
+
+Predictions = Dict[int, Tuple[str, float]]
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """
+    A content-addressed on-disk cache of the raw predictions and supernodes of each file.
+
+    Entries are keyed by the sha256 of the file content, the model, the typing rules and the
+    graph generator version. When the cache grows above max_size_bytes, the least recently
+    used entries are evicted.
+    """
+
+    def __init__(
+        self, cache_dir: str, model_path: str, typing_rules_path: str, max_size_bytes: int
+    ):
+        self.__cache_dir = cache_dir
+        self.__max_size_bytes = max_size_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.__key_prefix = (
+            f"{_file_digest(model_path)}:{_file_digest(typing_rules_path)}:"
+            f"{GRAPH_GENERATOR_VERSION}:"
+        ).encode()
+
+        self.hits = 0  # type: int
+        self.misses = 0  # type: int
+        self.evictions = 0  # type: int
+
+    def key_for(self, file_content: bytes) -> str:
+        return hashlib.sha256(self.__key_prefix + file_content).hexdigest()
+
+    def __entry_path(self, key: str) -> str:
+        return os.path.join(self.__cache_dir, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[Tuple[Predictions, Dict[str, Any]]]:
+        entry_path = self.__entry_path(key)
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(entry_path)  # Mark as recently used.
+        self.hits += 1
+        predictions = {idx: (t, prob) for idx, t, prob in entry["predictions"]}
+        return predictions, entry["supernodes"]
+
+    def put(self, key: str, predictions: Predictions, supernodes: Dict[Any, Any]) -> None:
+        entry_path = self.__entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        entry = {
+            "predictions": [
+                [int(idx), str(t), float(prob)] for idx, (t, prob) in predictions.items()
+            ],
+            "supernodes": {str(idx): data for idx, data in supernodes.items()},
+        }
+        tmp_path = entry_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, entry_path)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in max_size_bytes."""
+        entries = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(self.__cache_dir):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, filename)))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.__max_size_bytes:
+                break
+            os.remove(path)
+            total_size -= size
+            self.evictions += 1
+
+    def __str__(self) -> str:
+        return (
+            f"Prediction cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions."
+        )
@@ -0,0 +1,220 @@
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from annotationutils import annotation_rewrite
+from graph_generator.extract_graphs import iter_graphs
+from graph_generator.phasetimings import timings
+from graph_generator.type_lattice_generator import TypeLatticeGenerator
+from predictioncache import PredictionCache
+
+DEFAULT_TYPING_RULES_PATH = os.path.join(os.path.dirname(__file__), "metadata", "typingRules.json")
+
+# Do not suggest annotations on variables for now.
+SUGGESTIBLE_SYMBOL_KINDS = frozenset({"class-or-function", "parameter", "imported"})
+
+
+class TypeSuggestion:
+    def __init__(
+        self,
+        filepath: str,
+        name: str,
+        file_location: Tuple[int, int],
+        suggestion: str,
+        symbol_kind: str,
+        confidence: float,
+        annotation_lineno: int = 0,
+        is_disagreement: bool = False,
+    ):
+        self.filepath = filepath
+        self.name = name
+        self.file_location = file_location
+        self.suggestion = suggestion
+        self.symbol_kind = symbol_kind
+        self.confidence = confidence
+        self.annotation_lineno = annotation_lineno
+        self.is_disagreement = is_disagreement
+
+    def __repr__(self) -> str:
+        return (
+            f"Suggestion@{self.filepath}:{self.file_location} "
+            f"Symbol Name: `{self.name}` Suggestion `{self.suggestion}` "
+            f"Confidence: {self.confidence:.2%}"
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "filepath": self.filepath,
+            "name": self.name,
+            "file_location": list(self.file_location),
+            "suggestion": self.suggestion,
+            "symbol_kind": self.symbol_kind,
+            "confidence": self.confidence,
+            "annotation_lineno": self.annotation_lineno,
+            "is_disagreement": self.is_disagreement,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "TypeSuggestion":
+        return TypeSuggestion(
+            data["filepath"],
+            data["name"],
+            tuple(data["file_location"]),
+            data["suggestion"],
+            data["symbol_kind"],
+            data["confidence"],
+            annotation_lineno=data.get("annotation_lineno", 0),
+            is_disagreement=data.get("is_disagreement", False),
+        )
+
+
+def restore_model(model_path: str):
+    # Imported here so that clients of the inference server do not need torch.
+    from ptgnn.implementations.typilus.graph2class import Graph2Class
+
+    with timings.phase("model restore"):
+        return Graph2Class.restore_model(model_path, "cpu")
+
+
+def _suggestions_from_predictions(
+    filepath: str,
+    predictions: Dict[int, Tuple[str, float]],
+    supernodes: Dict[Any, Dict[str, Any]],
+    lines_of_interest: Set[int],
+    suggestion_confidence_threshold: float,
+    debug: bool,
+) -> List[TypeSuggestion]:
+    if debug:
+        print("Predictions:", predictions)
+        print("SuperNodes:", supernodes)
+
+    # In-memory graphs have int supernode ids, while graphs loaded from JSON have str ids.
+    supernodes = {str(k): v for k, v in supernodes.items()}
+    type_suggestions: List[TypeSuggestion] = []
+    for supernode_idx, (predicted_type, predicted_prob) in predictions.items():
+        supernode_data = supernodes[str(supernode_idx)]
+        if supernode_data["type"] not in SUGGESTIBLE_SYMBOL_KINDS:
+            continue
+        lineno, colno = supernode_data["location"]
+        suggestion = TypeSuggestion(
+            filepath,
+            supernode_data["name"],
+            (lineno, colno),
+            annotation_rewrite(predicted_type),
+            supernode_data["type"],
+            predicted_prob,
+            is_disagreement=supernode_data["annotation"] != "??"
+            and supernode_data["annotation"] != predicted_type,
+        )
+
+        print("Suggestion: ", suggestion)
+
+        if lineno not in lines_of_interest:
+            continue
+        elif suggestion.name == "%UNK%":
+            continue
+
+        if (
+            supernode_data["annotation"] == "??"
+            and suggestion.confidence > suggestion_confidence_threshold
+        ):
+            type_suggestions.append(suggestion)
+        elif (
+            suggestion.is_disagreement
+            # and suggestion.confidence > diagreement_confidence_threshold
+        ):
+            pass  # TODO: Disabled for now: type_suggestions.append(suggestion)
+    return type_suggestions
+
+
+def compute_type_suggestions(
+    repo_path: str,
+    changed_files: Dict[str, Set[int]],
+    model,
+    nn,
+    suggestion_confidence_threshold: float,
+    typing_rules_path: str = DEFAULT_TYPING_RULES_PATH,
+    type_lattice: Optional[TypeLatticeGenerator] = None,
+    graph_output_dir: Optional[str] = None,
+    prediction_cache: Optional[PredictionCache] = None,
+    jobs: int = 1,
+    debug: bool = False,
+) -> List[TypeSuggestion]:
+    """
+    Extract the graphs of the changed files, run the model on them and return the
+    suggestions that fall on changed lines.
+
+    Graphs are handed to the model in memory. If graph_output_dir is given, they are also
+    saved there for debugging. Files found in the prediction_cache skip both graph
+    extraction and inference.
+
+    Only the symbols that can be suggested are given to the model. Without a prediction_cache
+    these are also restricted to the changed lines; cached predictions are reused across diffs,
+    so they cover all the lines of a file. With jobs > 1, the graphs are extracted by a pool of
+    worker processes. The type lattice is not built, since the model does not use it.
+    """
+    type_suggestions: List[TypeSuggestion] = []
+
+    files_to_extract = set(changed_files)
+    cache_keys: Dict[str, str] = {}
+    if prediction_cache is not None:
+        for filepath in changed_files:
+            try:
+                with open(repo_path + filepath, "rb") as f:
+                    cache_key = prediction_cache.key_for(f.read())
+            except OSError:
+                continue
+            cached = prediction_cache.get(cache_key)
+            if cached is None:
+                cache_keys[filepath] = cache_key
+                continue
+            files_to_extract.discard(filepath)
+            predictions, supernodes = cached
+            type_suggestions.extend(
+                _suggestions_from_predictions(
+                    filepath,
+                    predictions,
+                    supernodes,
+                    changed_files[filepath],
+                    suggestion_confidence_threshold,
+                    debug,
+                )
+            )
+
+    if len(files_to_extract) > 0:
+        graphs = iter_graphs(
+            repo_path,
+            typing_rules_path,
+            files_to_extract=files_to_extract,
+            target_folder=graph_output_dir,
+            type_lattice=type_lattice,
+            lines_of_interest=changed_files if prediction_cache is None else None,
+            symbol_kinds=SUGGESTIBLE_SYMBOL_KINDS,
+            jobs=jobs,
+            build_type_lattice=False,
+        )
+        # The graphs are extracted lazily within model.predict. Since nested phases are
+        # timed separately, the "inference" phase excludes the graph extraction.
+        for graph, predictions in timings.iterate("inference", model.predict(graphs, nn, "cpu")):
+            # predictions has the type: Dict[int, Tuple[str, float]]
+            filepath = graph["filename"]
+            if filepath in cache_keys:
+                prediction_cache.put(cache_keys.pop(filepath), predictions, graph["supernodes"])
+            type_suggestions.extend(
+                _suggestions_from_predictions(
+                    filepath,
+                    predictions,
+                    graph["supernodes"],
+                    changed_files[filepath],
+                    suggestion_confidence_threshold,
+                    debug,
+                )
+            )
+
+    if prediction_cache is not None:
+        # Files without any graph (e.g. unparsable or without symbols) have no predictions.
+        for cache_key in cache_keys.values():
+            prediction_cache.put(cache_key, {}, {})
+        prediction_cache.evict()
+        print(prediction_cache)
+
+    return type_suggestions